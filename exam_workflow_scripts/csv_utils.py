@@ -1,5 +1,6 @@
 import csv
 import os
+import pickle
 import sys
 
 # --- CSV Column Mapping ---
@@ -47,3 +48,121 @@ def load_students_from_csv_files(csv_file_paths): # Accepts a list of file paths
         except Exception as e:
             print(f"❌ Error reading CSV file '{csv_file}': {e}", file=sys.stderr)
     return all_students
+
+# --- Roster index ---
+ROSTER_CACHE_FILE = ".roster_index.pickle" # Written next to the CSVs; rebuilt when any CSV changes
+ROSTER_CACHE_VERSION = 1
+ROSTER_MAX_ID_DISTANCE = 1 # Edits allowed when resolving a misread ID to a roster ID
+
+def edit_distance(a, b):
+    """Levenshtein distance between two strings."""
+    if len(a) < len(b): a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        previous = current
+    return previous[-1]
+
+def build_bk_tree(words):
+    """BK-tree over 'words' as nested [word, {distance: child}] lists (picklable, no classes)."""
+    tree = None
+    for word in words:
+        if tree is None:
+            tree = [word, {}]
+            continue
+        node = tree
+        while True:
+            d = edit_distance(word, node[0])
+            if d == 0: break
+            if d not in node[1]:
+                node[1][d] = [word, {}]
+                break
+            node = node[1][d]
+    return tree
+
+def search_bk_tree(tree, word, max_distance):
+    """Returns [(distance, word)] for every word within max_distance, closest first."""
+    found, pending = [], [tree] if tree else []
+    while pending:
+        node = pending.pop()
+        d = edit_distance(word, node[0])
+        if d <= max_distance: found.append((d, node[0]))
+        pending.extend(child for dist, child in node[1].items() if d - max_distance <= dist <= d + max_distance)
+    return sorted(found)
+
+def build_roster_index(csv_file_paths):
+    """
+    Parses the CSVs into a roster index: students by ID, by class file and by email, a BK-tree over the IDs
+    for near-miss lookups, and the IDs that appear more than once (with the files they come from).
+    When an ID is repeated, the last file read wins (same as a plain dict built from the list).
+    """
+    index = {"by_id": {}, "by_file": {}, "by_email": {}, "duplicates": {}}
+    files_per_id = {}
+    for csv_file in csv_file_paths:
+        file_name = os.path.basename(csv_file)
+        students = load_students_from_csv_files([csv_file])
+        index["by_file"][file_name] = students
+        for student in students:
+            student = dict(student, file=file_name)
+            index["by_id"][student["id"]] = student
+            index["by_email"][student["email"].lower()] = student
+            files_per_id.setdefault(student["id"], []).append(file_name)
+
+    index["duplicates"] = {student_id: files for student_id, files in files_per_id.items() if len(files) > 1}
+    index["bk_tree"] = build_bk_tree(sorted(index["by_id"]))
+    return index
+
+def roster_cache_key(csv_file_paths):
+    """Identifies a set of CSVs: path, modification time and size of each one."""
+    key = [ROSTER_CACHE_VERSION]
+    for csv_file in csv_file_paths:
+        try:
+            stat = os.stat(csv_file)
+            key.append((os.path.abspath(csv_file), stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            key.append((os.path.abspath(csv_file), None, None))
+    return tuple(key)
+
+def load_roster_index(csv_file_paths, cache_path=None):
+    """
+    Roster index for 'csv_file_paths', read from a pickle cache when no CSV has changed since it was written.
+    cache_path defaults to ROSTER_CACHE_FILE in the folder of the first CSV; "" disables the cache.
+    """
+    csv_file_paths = sorted(csv_file_paths)
+    if cache_path is None and csv_file_paths:
+        cache_path = os.path.join(os.path.dirname(os.path.abspath(csv_file_paths[0])), ROSTER_CACHE_FILE)
+    key = roster_cache_key(csv_file_paths)
+
+    if cache_path and os.path.exists(cache_path):
+        try:
+            with open(cache_path, "rb") as f:
+                cached = pickle.load(f)
+            if cached.get("key") == key:
+                return cached["index"]
+        except Exception as e: # Corrupt or incompatible cache: rebuild it
+            print(f"⚠️ Warning: Ignoring roster cache '{cache_path}' ({e}).", file=sys.stderr)
+
+    index = build_roster_index(csv_file_paths)
+    if cache_path:
+        try:
+            with open(cache_path + ".part", "wb") as f:
+                pickle.dump({"key": key, "index": index}, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(cache_path + ".part", cache_path)
+        except OSError as e:
+            print(f"⚠️ Warning: Could not write roster cache '{cache_path}' ({e}).", file=sys.stderr)
+    return index
+
+def nearest_student_id(index, student_id, max_distance=ROSTER_MAX_ID_DISTANCE):
+    """
+    Resolves a (possibly misread) ID to a roster ID. Returns the ID itself if it is on the roster, the single
+    closest roster ID within max_distance edits, or None if there is none or the closest match is ambiguous.
+    An ID missing from the roster is more often a student whose CSV is not loaded than a misread (QR codes are
+    error-corrected), so callers should treat the closest ID as a candidate that needs other evidence.
+    """
+    if student_id in index["by_id"]: return student_id
+    matches = search_bk_tree(index["bk_tree"], student_id, max_distance)
+    if not matches: return None
+    if len(matches) > 1 and matches[1][0] == matches[0][0]: return None # Two equally close IDs: do not guess
+    return matches[0][1]
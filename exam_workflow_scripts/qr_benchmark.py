@@ -0,0 +1,545 @@
+import fitz # PyMuPDF
+from PIL import Image
+import numpy as np
+import io
+import os
+import sys
+import time
+import multiprocessing
+import resource
+import tempfile
+import contextlib
+import hashlib
+import json
+import random
+import cv2
+
+from exam_workflow_scripts import qr_reorderer
+from exam_workflow_scripts import qr_generator
+from exam_workflow_scripts.csv_utils import load_students_from_csv_files
+
+# --- CONFIGURATION ---
+MAX_PAGINES = 20  # Pages of the scan used for each benchmark
+REPETICIONS = 3   # Each measurement keeps the best of N runs to reduce noise
+MIDES_MEMORIA = (40, 80, 160) # Synthetic batch sizes (pages) for the streaming memory check
+TOLERANCIA_MEMORIA = 0.25     # Allowed peak RSS growth between the smallest and the largest batch
+MIDA_FINESTRA_MEMORIA = 20    # Streaming window used by the check (smaller than the batches, so several windows run)
+ALUMNES_GENERACIO = 40  # Synthetic roster size for the exam generation benchmark
+PAGINES_GENERACIO = 12  # The template is repeated up to this many pages (a typical exam)
+RUTA_PLANTILLA_BASE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates", qr_generator.FITXER_BASE)
+
+# --- END-TO-END SUITE ---
+PAGINES_SUITE = 6   # Pages per synthetic exam (one exam per student of the bundled test rosters)
+DPI_ESCANER = 150   # Resolution of the simulated scans
+LLAVOR_SUITE = 1234 # Every degradation is drawn from a seeded generator: runs are reproducible
+FITXER_RESULTATS_SUITE = "qr_benchmark_results.json"
+FITXER_BASELINE_SUITE = "qr_benchmark_baseline.json"
+# Allowed loss against the baseline before the suite fails: relative for throughput, absolute for rates
+TOLERANCIA_REGRESSIO = {"pagines_s": 0.20, "taxa_descodificacio": 0.02, "precisio_deduccio": 0.02, "cobertura_deduccio": 0.05,
+                        "deteccio_apartades": 0.05}
+# Scenarios: degradations applied to every page (probabilities are per page)
+ESCENARIS_SUITE = {
+    "net": {},
+    "rotacio": {"rotacio": 0.3},                  # Page fed at 90/180/270 degrees
+    "inclinacio": {"inclinacio": 4.0},            # Random skew up to +-4 degrees
+    "desenfocament": {"desenfocament": 1.2},      # Gaussian blur (sigma, pixels)
+    "soroll": {"soroll": 25},                     # Gaussian noise (sigma, grey levels)
+    "jpeg": {"jpeg": 20},                         # JPEG quality of the scanned images
+    "barrejat": {"barrejat": True},               # Page order shuffled across the whole batch
+    "perdudes": {"perdudes": 0.1},                # Pages missing from the batch
+    "qr_ilegible": {"qr_ilegible": 0.2},          # QR covered (only deduction can place the page)
+    "brut": {"duplicades": 0.15, "blanques": 0.15, "soroll": 12, "qr_ilegible": 0.1}, # Double feeds and blank back sides
+    "combinat": {"rotacio": 0.1, "inclinacio": 2.0, "desenfocament": 0.8, "soroll": 12, "jpeg": 40, "qr_ilegible": 0.1},
+}
+
+# ==============================================================================
+# 1. RENDER PATH (PNG round-trip vs direct pixmap buffer)
+# ==============================================================================
+def render_amb_png(page, dpi):
+    """Previous render path: RGB pixmap -> PNG bytes -> PIL -> NumPy -> BGR."""
+    pix = page.get_pixmap(dpi=dpi)
+    img_np = np.array(Image.open(io.BytesIO(pix.tobytes("png"))))
+    return qr_reorderer.convertir_a_bgr(img_np)
+
+def render_directe(page, dpi):
+    """Current render path: grayscale pixmap wrapped as a NumPy array with no copy."""
+    return qr_reorderer.renderitzar_pagina(page, dpi)
+
+def mesurar_per_pagina(funcio, doc, pagines, dpi):
+    """Returns the best time per page (seconds) over REPETICIONS runs."""
+    millor = float("inf")
+    for _ in range(REPETICIONS):
+        inici = time.perf_counter()
+        for i in pagines:
+            funcio(doc[i], dpi)
+        millor = min(millor, (time.perf_counter() - inici) / len(pagines))
+    return millor
+
+def benchmark_render(ruta_pdf, dpi=qr_reorderer.DPI_DETECCIO):
+    dpi = int(dpi) # May come from the command line
+    doc = fitz.open(ruta_pdf)
+    pagines = list(range(min(MAX_PAGINES, doc.page_count)))
+    print(f"⏱️ Render benchmark: '{os.path.basename(ruta_pdf)}', {len(pagines)} pages at {dpi} DPI")
+
+    t_png = mesurar_per_pagina(render_amb_png, doc, pagines, dpi)
+    t_directe = mesurar_per_pagina(render_directe, doc, pagines, dpi)
+    doc.close()
+
+    print(f"   PNG round-trip : {t_png * 1000:8.1f} ms/page")
+    print(f"   Direct buffer  : {t_directe * 1000:8.1f} ms/page")
+    print(f"   Speed-up       : {t_png / t_directe:8.2f}x")
+    return {"png_ms": t_png * 1000, "directe_ms": t_directe * 1000}
+
+# ==============================================================================
+# 2. STREAMING MEMORY (peak RSS must stay flat as the batch grows)
+# ==============================================================================
+def crear_lot_sintetic(ruta_pdf, n_pagines, ruta_sortida):
+    """Builds an n-page scan by cycling through the pages of 'ruta_pdf'. Every page gets its own
+    JPEG stream (with a little noise) so that nothing is shared between pages, as in a real scan."""
+    font = fitz.open(ruta_pdf)
+    lot = fitz.open()
+    rng = np.random.default_rng(0)
+    for i in range(n_pagines):
+        page = font[i % font.page_count]
+        img = qr_reorderer.renderitzar_pagina(page, 150).astype(np.int16)
+        img = np.clip(img + rng.integers(-8, 9, img.shape), 0, 255).astype(np.uint8)
+        pix = fitz.Pixmap(fitz.csGRAY, img.shape[1], img.shape[0], img.tobytes(), False)
+        nova = lot.new_page(width=page.rect.width, height=page.rect.height)
+        nova.insert_image(nova.rect, stream=pix.tobytes("jpg", jpg_quality=85))
+    lot.save(ruta_sortida)
+    lot.close()
+    font.close()
+
+def _processar_i_mesurar(ruta_in, ruta_out, diccionari, configuracio, cua):
+    """Runs in a fresh process so that ru_maxrss only reflects this batch."""
+    sys.stdout = open(os.devnull, "w")
+    for clau, valor in configuracio.items():
+        setattr(qr_reorderer, clau, valor)
+    qr_reorderer.processar_un_pdf(ruta_in, ruta_out, diccionari, workers=1)
+    cua.put(pic_memoria_mb())
+
+def pic_memoria_mb():
+    """Peak RSS of this process in MB. VmHWM is preferred: ru_maxrss survives the exec() of a spawned
+    child, so it would include the parent's memory."""
+    try:
+        with open("/proc/self/status") as f:
+            for linia in f:
+                if linia.startswith("VmHWM:"):
+                    return int(linia.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024 # KB on Linux
+
+def benchmark_memoria(ruta_pdf, *mides):
+    """Processes growing synthetic batches in streaming mode and fails if the peak RSS grows with them."""
+    mides = [int(m) for m in mides] or list(MIDES_MEMORIA)
+    # No decode cache: every size is built from the same seed, so the larger batches would hit the smaller ones' pages
+    configuracio = {"MODE_STREAMING": True, "MIDA_FINESTRA": MIDA_FINESTRA_MEMORIA, "CARPETA_DEBUG": tempfile.gettempdir(),
+                    "FITXER_CACHE_DECODIFICACIO": None, "FITXER_INDEX_PAGINES": None}
+    qr_reorderer.carregar_base_dades_alumnes()
+    context = multiprocessing.get_context("spawn")
+    pics = {}
+
+    with tempfile.TemporaryDirectory() as carpeta:
+        for n in mides:
+            ruta_in = os.path.join(carpeta, f"lot_{n}.pdf")
+            crear_lot_sintetic(ruta_pdf, n, ruta_in)
+            cua = context.Queue()
+            proces = context.Process(target=_processar_i_mesurar,
+                                     args=(ruta_in, os.path.join(carpeta, "out", f"lot_{n}.pdf"), qr_reorderer.DICCIONARI_ALUMNES, configuracio, cua))
+            proces.start()
+            pics[n] = cua.get()
+            proces.join()
+            print(f"   {n:5d} pages -> peak RSS {pics[n]:8.1f} MB")
+
+    creixement = (pics[mides[-1]] - pics[mides[0]]) / pics[mides[0]]
+    print(f"   Growth {mides[0]} -> {mides[-1]} pages: {creixement * 100:+.1f}% (allowed {TOLERANCIA_MEMORIA * 100:.0f}%)")
+    if creixement > TOLERANCIA_MEMORIA:
+        print("❌ Peak memory grows with the batch size.", file=sys.stderr)
+        sys.exit(1)
+    print("✅ Peak memory is flat.")
+    return pics
+
+# ==============================================================================
+# 3. EXAM GENERATION (reopening base.pdf per student vs prepared template)
+# ==============================================================================
+def generar_examens_llegat(base_pdf_path, students_data, output_dir_for_exams):
+    """Previous generation loop (kept verbatim for comparison): reopens the template and searches the
+    placeholder on every page of every copy."""
+    for alumne in students_data:
+        doc = fitz.open(base_pdf_path) # Open a fresh copy for each student
+
+        for page_num, page in enumerate(doc):
+            areas_trobades = page.search_for(qr_generator.TEXT_A_BUSCAR)
+            for rect in areas_trobades:
+                adjusted_rect = fitz.Rect(rect.x0, rect.y0 + 3, rect.x1, rect.y1 - 3)
+                page.draw_rect(adjusted_rect, color=(1, 1, 1), fill=(1, 1, 1))
+                page.insert_text((rect.x0, rect.y1 - 2), alumne['nom'], fontsize=qr_generator.MIDA_TEXT, fontname=qr_generator.FONT_TEXT, color=(0, 0, 0))
+
+            qr_content = f'{alumne["id"]}-{page_num + 1}'
+            qr_bytes = qr_generator.generar_imatge_qr(qr_content)
+            rect_qr = fitz.Rect(qr_generator.POS_QR_X, qr_generator.POS_QR_Y, qr_generator.POS_QR_X + qr_generator.MIDA_QR, qr_generator.POS_QR_Y + qr_generator.MIDA_QR)
+            page.insert_image(rect_qr, stream=qr_bytes)
+
+        nom_fitxer = f"Examen_{alumne['nom'].replace(' ', '_')}.pdf"
+        doc.save(os.path.join(output_dir_for_exams, nom_fitxer))
+        doc.close()
+
+def crear_plantilla_sintetica(ruta_base, n_pagines, ruta_sortida):
+    """Repeats the pages of the base template until it has n_pagines."""
+    base = fitz.open(ruta_base)
+    plantilla = fitz.open()
+    while plantilla.page_count < n_pagines:
+        plantilla.insert_pdf(base, to_page=min(base.page_count, n_pagines - plantilla.page_count) - 1)
+    plantilla.save(ruta_sortida)
+    plantilla.close()
+    base.close()
+
+def signatura_pdf(ruta_pdf):
+    """What a PDF shows, independent of object numbering: per page, its drawing commands and image data."""
+    h = hashlib.sha256()
+    with fitz.open(ruta_pdf) as doc:
+        for page in doc:
+            h.update(page.read_contents())
+            for imatge in page.get_images(full=True):
+                h.update(doc.xref_stream(imatge[0]))
+    return h.hexdigest()
+
+def signatures_carpeta(carpeta):
+    return {f: signatura_pdf(os.path.join(carpeta, f)) for f in sorted(os.listdir(carpeta))}
+
+def mesurar_generacio(funcio, ruta_plantilla, alumnes, carpeta):
+    """Returns the best time (seconds) over REPETICIONS runs, with the generator's output silenced.
+    The QR matrix cache is emptied before each run, so every run encodes the roster from scratch."""
+    millor = float("inf")
+    for _ in range(REPETICIONS):
+        qr_generator.obtenir_matriu_qr.cache_clear()
+        qr_generator.cami_qr.cache_clear()
+        inici = time.perf_counter()
+        with open(os.devnull, "w") as nul, contextlib.redirect_stdout(nul):
+            funcio(ruta_plantilla, alumnes, carpeta)
+        millor = min(millor, time.perf_counter() - inici)
+    return millor
+
+def mida_mitjana_kb(carpeta):
+    fitxers = os.listdir(carpeta)
+    return sum(os.path.getsize(os.path.join(carpeta, f)) for f in fitxers) / len(fitxers) / 1024
+
+def pagines_llegides(carpeta, dpi):
+    """Pages whose QR the reorderer reads with a single quick attempt on its crop window at 'dpi' (its cheapest tier)."""
+    llegides = total = 0
+    for f in sorted(os.listdir(carpeta)):
+        with fitz.open(os.path.join(carpeta, f)) as doc:
+            for page in doc:
+                total += 1
+                img_np = qr_reorderer.renderitzar_pagina(page, dpi, qr_reorderer.obtenir_clip_zona(page))
+                llegides += qr_reorderer.llegir_qr_rapid(img_np)[0] is not None
+    return llegides, total
+
+def benchmark_generacio(ruta_base=None, n_alumnes=ALUMNES_GENERACIO, n_pagines=PAGINES_GENERACIO):
+    """Exams per second, file size and QR readability of the legacy loop vs the template-stamping engine
+    (with PNG and with vector QR codes). Fails if the PNG mode changes the content of any exam."""
+    ruta_base = ruta_base or RUTA_PLANTILLA_BASE
+    n_alumnes, n_pagines = int(n_alumnes), int(n_pagines)
+    alumnes = [{"id": f"{100000 + i}", "nom": f"Alumne Sintetic {i}", "email": f"alumne{i}@example.com"} for i in range(n_alumnes)]
+    dpi_lectura = qr_reorderer.NIVELLS_DPI[0]
+    print(f"⏱️ Generation benchmark: '{os.path.basename(ruta_base)}' x {n_pagines} pages, {n_alumnes} students")
+
+    resultats = {}
+    vectorial = qr_generator.QR_VECTORIAL
+    with tempfile.TemporaryDirectory() as carpeta:
+        ruta_plantilla = os.path.join(carpeta, "plantilla.pdf")
+        crear_plantilla_sintetica(ruta_base, n_pagines, ruta_plantilla)
+        carpetes = {nom: os.path.join(carpeta, nom) for nom in ("llegat", "png", "vectorial")}
+        os.makedirs(carpetes["llegat"])
+
+        try:
+            resultats["llegat"] = mesurar_generacio(generar_examens_llegat, ruta_plantilla, alumnes, carpetes["llegat"])
+            qr_generator.QR_VECTORIAL = False
+            resultats["png"] = mesurar_generacio(qr_generator.generate_individual_exams, ruta_plantilla, alumnes, carpetes["png"])
+            qr_generator.QR_VECTORIAL = True
+            resultats["vectorial"] = mesurar_generacio(qr_generator.generate_individual_exams, ruta_plantilla, alumnes, carpetes["vectorial"])
+        finally:
+            qr_generator.QR_VECTORIAL = vectorial
+        iguals = signatures_carpeta(carpetes["llegat"]) == signatures_carpeta(carpetes["png"])
+
+        noms = {"llegat": "Legacy loop", "png": "Stamping, PNG QR", "vectorial": "Stamping, vector QR"}
+        for clau, temps in resultats.items():
+            llegides, total = pagines_llegides(carpetes[clau], dpi_lectura)
+            print(f"   {noms[clau]:<20}: {n_alumnes / temps:7.1f} exams/sec, {mida_mitjana_kb(carpetes[clau]):7.1f} KB/exam, "
+                  f"QR read at {dpi_lectura} DPI: {llegides}/{total}")
+    print(f"   Speed-up (vector vs legacy): {resultats['llegat'] / resultats['vectorial']:.2f}x")
+
+    if not iguals:
+        print("❌ The generated PDFs differ from the legacy loop.", file=sys.stderr)
+        sys.exit(1)
+    print("✅ PNG mode generates the same content as the legacy loop.")
+    return {clau: n_alumnes / temps for clau, temps in resultats.items()}
+
+# ==============================================================================
+# 4. PRINT RUN (per-student files + make_archive vs single merged PDF / streamed ZIP)
+# ==============================================================================
+def mida_fitxers(carpeta):
+    """Total size of the regular files directly inside 'carpeta'."""
+    rutes = [os.path.join(carpeta, f) for f in os.listdir(carpeta)]
+    return sum(os.path.getsize(r) for r in rutes if os.path.isfile(r))
+
+def benchmark_tirada(ruta_base=None, n_alumnes=ALUMNES_GENERACIO, n_pagines=PAGINES_GENERACIO, *workers):
+    """Time and disk traffic of a whole print run. Disk traffic counts every byte written, plus the bytes
+    make_archive reads back from the per-student files."""
+    ruta_base = ruta_base or RUTA_PLANTILLA_BASE
+    n_alumnes, n_pagines = int(n_alumnes), int(n_pagines)
+    workers = [int(w) for w in workers] or sorted({1, os.cpu_count() or 1})
+    alumnes = [{"id": f"{100000 + i}", "nom": f"Alumne Sintetic {i}", "email": f"alumne{i}@example.com"} for i in range(n_alumnes)]
+    print(f"⏱️ Print run benchmark: '{os.path.basename(ruta_base)}' x {n_pagines} pages, {n_alumnes} students")
+
+    with tempfile.TemporaryDirectory() as carpeta:
+        ruta_plantilla = os.path.join(carpeta, "plantilla.pdf")
+        crear_plantilla_sintetica(ruta_base, n_pagines, ruta_plantilla)
+
+        def fitxers_i_zip(sortida):
+            qr_generator.generate_individual_exams(ruta_plantilla, alumnes, os.path.join(sortida, "examens"))
+            qr_generator.create_zip_of_exams(os.path.join(sortida, "examens"), sortida)
+
+        mesures = [("Files + make_archive", 1, fitxers_i_zip)]
+        for mode in ("zip", "pdf"):
+            for n in workers:
+                mesures.append((f"Single {mode.upper()}", n, lambda sortida, mode=mode, n=n: qr_generator.generar_tirada(ruta_plantilla, alumnes, sortida, mode, n)))
+
+        resultats = {}
+        for nom, n, funcio in mesures:
+            sortida = os.path.join(carpeta, f"{nom}_{n}".replace(" ", "_"))
+            qr_generator.obtenir_matriu_qr.cache_clear()
+            qr_generator.cami_qr.cache_clear()
+            inici = time.perf_counter()
+            with open(os.devnull, "w") as nul, contextlib.redirect_stdout(nul):
+                funcio(sortida)
+            temps = time.perf_counter() - inici
+            carpeta_examens = os.path.join(sortida, "examens")
+            transit = mida_fitxers(sortida)
+            if os.path.isdir(carpeta_examens):
+                transit += 2 * mida_fitxers(carpeta_examens) # Written, then read back by make_archive
+            resultats[(nom, n)] = {"examens_s": n_alumnes / temps, "disc_kb": transit / 1024}
+            print(f"   {nom:<21} {n:2d} workers: {n_alumnes / temps:7.1f} exams/sec, disk traffic {transit / 1024:9.1f} KB")
+    return resultats
+
+# ==============================================================================
+# 5. END-TO-END SUITE (synthetic degraded scans -> processar_un_pdf, compared against a baseline)
+# ==============================================================================
+def alumnes_de_prova():
+    """Students of the bundled test rosters (student_data/*.csv)."""
+    carpeta = os.path.join(os.path.dirname(os.path.abspath(__file__)), qr_reorderer.STUDENT_DATA_DIR)
+    return load_students_from_csv_files(sorted(os.path.join(carpeta, f) for f in os.listdir(carpeta) if f.lower().endswith(".csv")))
+
+def degradar_pagina(img, params, rng, ocultar_qr):
+    """Applies the scenario's degradations to one grayscale scan (uint8 array)."""
+    if ocultar_qr:
+        escala = DPI_ESCANER / 72
+        x0, y0 = int(qr_generator.POS_QR_X * escala) - 2, int(qr_generator.POS_QR_Y * escala) - 2
+        mida = int(qr_generator.MIDA_QR * escala) + 4
+        img[y0:y0 + mida, x0:x0 + mida // 2] = 255 # Half the code wiped out: no engine can read it
+    if params.get("desenfocament"):
+        img = cv2.GaussianBlur(img, (0, 0), params["desenfocament"])
+    if params.get("inclinacio"):
+        angle = rng.uniform(-params["inclinacio"], params["inclinacio"])
+        h, w = img.shape
+        matriu = cv2.getRotationMatrix2D((w / 2, h / 2), angle, 1.0)
+        img = cv2.warpAffine(img, matriu, (w, h), borderValue=255)
+    if params.get("soroll"):
+        img = np.clip(img + rng.normal(0, params["soroll"], img.shape), 0, 255).astype(np.uint8)
+    if params.get("rotacio") and rng.random() < params["rotacio"]:
+        img = cv2.rotate(img, [cv2.ROTATE_90_CLOCKWISE, cv2.ROTATE_180, cv2.ROTATE_90_COUNTERCLOCKWISE][rng.integers(3)])
+    return img
+
+def crear_escaneig_sintetic(carpeta_examens, alumnes, params, ruta_sortida, llavor=LLAVOR_SUITE):
+    """Rasterizes the generated exams like a scanner would, applies 'params' and writes one batch PDF.
+    Returns the ground truth of every scanned page, in batch order: (student_id, page, qr_visible, set_apart),
+    where set_apart is "duplicat" for a second scan of the previous sheet and "blanca" for a blank back side."""
+    rng = np.random.default_rng(llavor)
+    examens = [(alumne["id"], fitz.open(os.path.join(carpeta_examens, qr_generator.nom_fitxer_examen(alumne)))) for alumne in alumnes]
+    pagines = [(page, id_alumne, n + 1) for id_alumne, examen in examens for n, page in enumerate(examen)] # Exams stacked in roster order
+
+    if params.get("barrejat"):
+        random.Random(llavor).shuffle(pagines)
+    if params.get("perdudes"):
+        pagines = [p for p in pagines if rng.random() >= params["perdudes"]]
+
+    veritat, escaneig = [], fitz.open()
+    def escanejar(img):
+        pix = fitz.Pixmap(fitz.csGRAY, img.shape[1], img.shape[0], img.tobytes(), False)
+        nova = escaneig.new_page(width=img.shape[1] * 72 / DPI_ESCANER, height=img.shape[0] * 72 / DPI_ESCANER)
+        nova.insert_image(nova.rect, stream=pix.tobytes("jpg", jpg_quality=params.get("jpeg", 85)))
+
+    for page, id_alumne, num in pagines:
+        ocultar_qr = num > 1 and rng.random() < params.get("qr_ilegible", 0) # First pages stay readable (deduction needs an anchor)
+        original = np.array(qr_reorderer.renderitzar_pagina(page, DPI_ESCANER))
+        if ocultar_qr: original = degradar_pagina(original, {}, rng, True) # Both scans of a sheet share the damage
+        escanejar(degradar_pagina(original.copy(), params, rng, False))
+        veritat.append((id_alumne, num, not ocultar_qr, None))
+        if params.get("duplicades") and rng.random() < params["duplicades"]: # Same sheet fed twice: same content, new noise
+            escanejar(degradar_pagina(original.copy(), params, rng, False))
+            veritat.append((id_alumne, num, not ocultar_qr, "duplicat"))
+        if params.get("blanques") and rng.random() < params["blanques"]:
+            escanejar(degradar_pagina(np.full_like(original, 255), params, rng, False))
+            veritat.append((None, None, False, "blanca"))
+    escaneig.save(ruta_sortida)
+    escaneig.close()
+    for _, examen in examens: examen.close()
+    return veritat
+
+@contextlib.contextmanager
+def mesurar_etapes(etapes, temps, captures):
+    """Temporarily wraps qr_reorderer functions to time them ({function: stage}); the return value of each
+    wrapped function is also kept in 'captures' (the page results, for scoring)."""
+    originals = {nom: getattr(qr_reorderer, nom) for nom in etapes}
+    def embolcallar(nom, funcio):
+        def embolcall(*args, **kwargs):
+            inici = time.perf_counter()
+            resultat = funcio(*args, **kwargs)
+            temps[etapes[nom]] = temps.get(etapes[nom], 0.0) + time.perf_counter() - inici
+            captures[nom] = resultat
+            return resultat
+        return embolcall
+    try:
+        for nom, funcio in originals.items():
+            setattr(qr_reorderer, nom, embolcallar(nom, funcio))
+        yield
+    finally:
+        for nom, funcio in originals.items():
+            setattr(qr_reorderer, nom, funcio)
+
+ETAPES_SUITE = {
+    "llegir_qr_pagines": "lectura_qr",
+    "marcar_duplicats": "lectura_qr",
+    "resoldre_ids_desconeguts": "deduccio",
+    "arreglar_forats_logicament": "deduccio",
+    "resoldre_duplicats": "deduccio",
+    "escriure_pdf_reordenat": "escriptura_pdf",
+}
+
+def puntuar_escenari(pages_info, veritat):
+    """Decode rate (readable QRs read correctly), deduction precision, deduction coverage (pages no engine
+    read that deduction placed correctly), blank and double-scanned pages set apart, and wrong reads."""
+    llegibles = sum(1 for _, _, visible, apartada in veritat if visible and not apartada)
+    apartades = sum(1 for *_, apartada in veritat if apartada)
+    correctes = deduides = deduides_ok = errors = apartades_ok = no_llegides = 0
+    for p in pages_info:
+        alumne, num, _, apartada = veritat[p["idx"]]
+        encert = (p["id"], p["pag_num"]) == (alumne, num)
+        if apartada or p.get("especial"):
+            if p.get("especial") == apartada and (apartada == "blanca" or encert):
+                apartades_ok += 1
+            elif p.get("especial") == "blanca" or (p["id"] is not None and not encert): # Exam page binned, or misplaced
+                errors += 1
+            continue
+        if p["metode"].startswith("✨") or p["id"] is None: no_llegides += 1
+        if p["metode"].startswith("✨"):
+            deduides += 1
+            deduides_ok += encert
+        elif p["id"] is not None:
+            correctes += encert
+            errors += not encert
+    return {
+        "taxa_descodificacio": correctes / llegibles if llegibles else 1.0,
+        "precisio_deduccio": deduides_ok / deduides if deduides else 1.0,
+        "cobertura_deduccio": deduides_ok / no_llegides if no_llegides else 1.0,
+        "deteccio_apartades": apartades_ok / apartades if apartades else 1.0,
+        "lectures_errones": errors,
+    }
+
+def comparar_amb_baseline(resultats, baseline):
+    """Returns the list of regressions (human-readable) of 'resultats' against 'baseline'."""
+    regressions = []
+    for escenari, base in baseline.get("escenaris", {}).items():
+        actual = resultats["escenaris"].get(escenari)
+        if actual is None: continue
+        if actual["pagines_s"] < base["pagines_s"] * (1 - TOLERANCIA_REGRESSIO["pagines_s"]):
+            regressions.append(f"{escenari}: {actual['pagines_s']:.2f} pages/sec (baseline {base['pagines_s']:.2f})")
+        for clau in ("taxa_descodificacio", "precisio_deduccio", "cobertura_deduccio", "deteccio_apartades"):
+            if clau in base and actual[clau] < base[clau] - TOLERANCIA_REGRESSIO[clau]:
+                regressions.append(f"{escenari}: {clau} {actual[clau]:.3f} (baseline {base[clau]:.3f})")
+        if actual["lectures_errones"] > base["lectures_errones"]:
+            regressions.append(f"{escenari}: {actual['lectures_errones']} wrong reads (baseline {base['lectures_errones']})")
+    return regressions
+
+def benchmark_suite(ruta_baseline=FITXER_BASELINE_SUITE, *escenaris):
+    """
+    Builds a synthetic scan per scenario from the bundled template and test rosters, runs processar_un_pdf on it
+    and reports pages/sec, per-stage time, decode rate and deduction accuracy. Results go to
+    FITXER_RESULTATS_SUITE; they are compared against 'ruta_baseline' (created from this run if missing)
+    and the suite fails on any regression beyond TOLERANCIA_REGRESSIO.
+    """
+    escenaris = list(escenaris) or list(ESCENARIS_SUITE)
+    alumnes = alumnes_de_prova()
+    diccionari = {a["id"]: a["nom"] for a in alumnes}
+    print(f"⏱️ End-to-end suite: {len(alumnes)} students x {PAGINES_SUITE} pages, {len(escenaris)} scenarios")
+
+    resultats = {"entorn": {"python": sys.version.split()[0], "pymupdf": fitz.VersionBind, "cpus": os.cpu_count()}, "escenaris": {}}
+
+    with tempfile.TemporaryDirectory() as carpeta:
+        configuracio = {"FITXER_CACHE_DECODIFICACIO": None, "FITXER_INDEX_PAGINES": None, "WORKERS_DETECCIO": 1,
+                        "MODE_STREAMING": False, "CARPETA_DEBUG": os.path.join(carpeta, "debug")}
+        anteriors = {clau: getattr(qr_reorderer, clau) for clau in configuracio}
+        ruta_plantilla = os.path.join(carpeta, "plantilla.pdf")
+        crear_plantilla_sintetica(RUTA_PLANTILLA_BASE, PAGINES_SUITE, ruta_plantilla)
+        carpeta_examens = os.path.join(carpeta, "examens")
+        with open(os.devnull, "w") as nul, contextlib.redirect_stdout(nul):
+            qr_generator.generate_individual_exams(ruta_plantilla, alumnes, carpeta_examens)
+
+        try:
+            for clau, valor in configuracio.items(): setattr(qr_reorderer, clau, valor)
+            for escenari in escenaris:
+                ruta_escaneig = os.path.join(carpeta, f"{escenari}.pdf")
+                veritat = crear_escaneig_sintetic(carpeta_examens, alumnes, ESCENARIS_SUITE[escenari], ruta_escaneig)
+                qr_reorderer.ESTADISTIQUES_CASCADA.clear() # Every scenario starts from the same priors
+
+                temps_etapes, captures = {}, {}
+                inici = time.perf_counter()
+                with mesurar_etapes(ETAPES_SUITE, temps_etapes, captures), open(os.devnull, "w") as nul, contextlib.redirect_stdout(nul):
+                    qr_reorderer.processar_un_pdf(ruta_escaneig, os.path.join(carpeta, "sortida", f"{escenari}.pdf"), diccionari, workers=1)
+                temps = time.perf_counter() - inici
+
+                mesura = {"pagines": len(veritat), "pagines_s": len(veritat) / temps,
+                          "temps_etapes": {etapa: round(t, 4) for etapa, t in temps_etapes.items()}}
+                mesura.update(puntuar_escenari(captures["resoldre_duplicats"], veritat))
+                resultats["escenaris"][escenari] = mesura
+                print(f"   {escenari:<14} {mesura['pagines']:4d} pages {mesura['pagines_s']:7.2f} pages/sec | "
+                      f"decode {mesura['taxa_descodificacio'] * 100:5.1f}% | deduction {mesura['precisio_deduccio'] * 100:5.1f}% "
+                      f"precise, {mesura['cobertura_deduccio'] * 100:5.1f}% covered | set apart {mesura['deteccio_apartades'] * 100:5.1f}% | "
+                      f"wrong reads {mesura['lectures_errones']} | "
+                      + ", ".join(f"{etapa} {t:.2f}s" for etapa, t in temps_etapes.items()))
+        finally:
+            for clau, valor in anteriors.items(): setattr(qr_reorderer, clau, valor)
+
+    with open(FITXER_RESULTATS_SUITE, "w", encoding="utf-8") as f:
+        json.dump(resultats, f, indent=4, ensure_ascii=False)
+    print(f"💾 Results saved to: {FITXER_RESULTATS_SUITE}")
+
+    if not os.path.exists(ruta_baseline):
+        with open(ruta_baseline, "w", encoding="utf-8") as f:
+            json.dump(resultats, f, indent=4, ensure_ascii=False)
+        print(f"📌 No baseline found: saved this run as '{ruta_baseline}'.")
+        return resultats
+
+    with open(ruta_baseline, encoding="utf-8") as f:
+        regressions = comparar_amb_baseline(resultats, json.load(f))
+    if regressions:
+        for r in regressions: print(f"❌ Regression: {r}", file=sys.stderr)
+        sys.exit(1)
+    print(f"✅ No regressions against '{ruta_baseline}'.")
+    return resultats
+
+BENCHMARKS = {
+    "render": benchmark_render,
+    "memoria": benchmark_memoria,
+    "generacio": benchmark_generacio,
+    "tirada": benchmark_tirada,
+    "suite": benchmark_suite,
+}
+
+if __name__ == "__main__":
+    # Usage: python -m exam_workflow_scripts.qr_benchmark <benchmark> <args...>
+    if len(sys.argv) < 2 or sys.argv[1] not in BENCHMARKS:
+        print(f"Usage: python -m exam_workflow_scripts.qr_benchmark [{'|'.join(BENCHMARKS)}] <args...>", file=sys.stderr)
+        sys.exit(1)
+    BENCHMARKS[sys.argv[1]](*sys.argv[2:])
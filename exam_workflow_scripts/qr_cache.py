@@ -0,0 +1,86 @@
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import time
+
+# --- CONFIGURATION ---
+MIDA_MAXIMA_MB = 64 # Size limit of the cache file contents; least recently used entries are evicted first
+
+# One connection per process and cache file (pool workers open their own)
+_CONNEXIONS = {}
+
+def obrir(ruta):
+    if ruta not in _CONNEXIONS:
+        carpeta = os.path.dirname(ruta)
+        if carpeta: os.makedirs(carpeta, exist_ok=True)
+        conn = sqlite3.connect(ruta, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL") # Workers read and write the same cache concurrently
+        conn.execute("""CREATE TABLE IF NOT EXISTS descodificacions (
+                            clau TEXT PRIMARY KEY, qr TEXT, metode TEXT, nivell TEXT,
+                            mida INTEGER NOT NULL, ultim_us REAL NOT NULL)""")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_ultim_us ON descodificacions (ultim_us)")
+        conn.commit()
+        _CONNEXIONS[ruta] = conn
+    return _CONNEXIONS[ruta]
+
+def hash_parametres(parametres):
+    """Fingerprint of the detector settings: changing any of them invalidates every cached decode."""
+    return hashlib.blake2b(json.dumps(parametres, sort_keys=True, default=str).encode("utf-8"), digest_size=16).hexdigest()
+
+def clau_pagina(page, hash_params):
+    """Content address of a page: its drawing commands, the raw (still compressed) image streams it shows,
+    its geometry and the detector settings. Nothing is decoded or rendered."""
+    doc = page.parent
+    h = hashlib.blake2b(digest_size=20)
+    h.update(hash_params.encode("ascii"))
+    h.update(f"{tuple(page.mediabox)}|{page.rotation}".encode("ascii"))
+    h.update(page.read_contents())
+    for imatge in page.get_images(full=True):
+        h.update(doc.xref_stream_raw(imatge[0]) or b"")
+    return h.hexdigest()
+
+def llegir(ruta, clau):
+    """Returns (qr_text, method, tier) for a page decoded before, or None. qr_text is None for pages that had no QR."""
+    try:
+        conn = obrir(ruta)
+        fila = conn.execute("SELECT qr, metode, nivell FROM descodificacions WHERE clau = ?", (clau,)).fetchone()
+        if fila:
+            conn.execute("UPDATE descodificacions SET ultim_us = ? WHERE clau = ?", (time.time(), clau))
+            conn.commit()
+        return fila
+    except sqlite3.Error as e:
+        print(f"⚠️ Decode cache unavailable ({e}).", file=sys.stderr)
+        return None
+
+def guardar(ruta, clau, qr, metode, nivell):
+    try:
+        conn = obrir(ruta)
+        mida = len(clau) + sum(len(x.encode("utf-8")) for x in (qr, metode, nivell) if x)
+        conn.execute("INSERT OR REPLACE INTO descodificacions VALUES (?, ?, ?, ?, ?, ?)",
+                     (clau, qr, metode, nivell, mida, time.time()))
+        conn.commit()
+    except sqlite3.Error as e:
+        print(f"⚠️ Could not write to the decode cache ({e}).", file=sys.stderr)
+
+def expulsar(ruta, mida_maxima_mb=MIDA_MAXIMA_MB):
+    """Evicts least recently used entries until the cached data fits in mida_maxima_mb."""
+    if not os.path.exists(ruta): return 0
+    try:
+        conn = obrir(ruta)
+        total = conn.execute("SELECT COALESCE(SUM(mida), 0) FROM descodificacions").fetchone()[0]
+        sobrant = total - mida_maxima_mb * 1024 * 1024
+        if sobrant <= 0: return 0
+
+        expulsades, alliberat = [], 0
+        for clau, mida in conn.execute("SELECT clau, mida FROM descodificacions ORDER BY ultim_us"):
+            expulsades.append((clau,))
+            alliberat += mida
+            if alliberat >= sobrant: break
+        conn.executemany("DELETE FROM descodificacions WHERE clau = ?", expulsades) # Freed pages are reused by SQLite
+        conn.commit()
+        return len(expulsades)
+    except sqlite3.Error as e:
+        print(f"⚠️ Could not evict decode cache entries ({e}).", file=sys.stderr)
+        return 0
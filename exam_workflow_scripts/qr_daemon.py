@@ -0,0 +1,137 @@
+import fitz # PyMuPDF
+import os
+import sys
+import time
+
+from exam_workflow_scripts import qr_reorderer, qr_metrics
+
+# --- CONFIGURATION ---
+# Seconds between two looks at qr_reorderer.CARPETA_ENTRADA
+INTERVAL_SONDEIG = 2.0
+# A PDF is processed once its size and modification time have not changed for this long
+# and MuPDF opens it without having to repair it (the scanner has written the trailer)
+TEMPS_ESTABILITAT = 5.0
+# PDFs that never open cleanly (broken scanner output) are still processed after being unchanged this long
+TEMPS_MAXIM_INCOMPLET = 60.0
+# Decode the pages already written of PDFs that are still growing (all but the last one) while waiting
+PRELECTURA = True
+# Per-PDF JSON-lines checkpoints of the decoded pages. A file's checkpoint is deleted once its output exists.
+CARPETA_PUNTS_CONTROL = ".qr_checkpoints"
+
+# ==============================================================================
+# 1. FILE STATE
+# ==============================================================================
+def firma_fitxer(ruta):
+    try:
+        st = os.stat(ruta)
+    except FileNotFoundError:
+        return None
+    return (st.st_size, st.st_mtime_ns)
+
+def ruta_punt_control(nom):
+    return os.path.join(CARPETA_PUNTS_CONTROL, nom + ".jsonl")
+
+def es_complet(ruta):
+    """A PDF MuPDF opens without repairing ends with a valid cross-reference table: it has been fully written."""
+    try:
+        with fitz.open(ruta) as doc:
+            return doc.page_count > 0 and not doc.is_repaired
+    except Exception:
+        return False
+
+def prellegir(ruta_in, nom, estat):
+    """Decodes and checkpoints the pages of a PDF that is still being written. The last page is left for later
+    (it may be incomplete); the final pass only decodes pages that are new or whose content changed."""
+    mostrar_errors = fitz.TOOLS.mupdf_display_errors()
+    fitz.TOOLS.mupdf_display_errors(False) # Repairing a half-written file is expected here
+    try:
+        with fitz.open(ruta_in) as doc:
+            fins_a = doc.page_count - 1
+            if fins_a <= estat["prellegides"]: return
+            print(f"📥 '{nom}' is still growing: decoding its first {fins_a} pages...")
+            qr_reorderer.llegir_qr_pagines_incremental(doc, ruta_in, ruta_punt_control(nom), fins_a)
+            estat["prellegides"] = fins_a
+    except Exception as e:
+        print(f"⚠️ Could not read '{nom}' yet ({e}).")
+    finally:
+        fitz.TOOLS.mupdf_display_errors(mostrar_errors)
+
+# ==============================================================================
+# 2. WATCH LOOP
+# ==============================================================================
+def processar_fitxer(nom):
+    """Reorders one finished PDF. Returns True if its output and JSON map were written."""
+    ruta_in = os.path.join(qr_reorderer.CARPETA_ENTRADA, nom)
+    ruta_out = os.path.join(qr_reorderer.CARPETA_SORTIDA, nom)
+    inici = time.time()
+    try:
+        qr_reorderer.carregar_base_dades_alumnes(sortir_si_buida=False) # Picks up roster changes (the parsed CSVs are cached)
+        resum = qr_reorderer.processar_un_pdf(ruta_in, ruta_out, qr_reorderer.DICCIONARI_ALUMNES,
+                                              ruta_punt_control=ruta_punt_control(nom))
+    except Exception as e:
+        print(f"❌ ERROR: Unexpected failure processing '{nom}': {e}", file=sys.stderr)
+        return False
+    if not resum["ok"]: return False
+
+    if os.path.exists(ruta_punt_control(nom)): os.remove(ruta_punt_control(nom))
+    qr_reorderer.guardar_estadistiques_cascada()
+    if "metriques" in resum and qr_reorderer.FITXER_PROMETHEUS:
+        METRIQUES_FITXERS[nom] = resum["metriques"]
+        qr_metrics.guardar_prometheus(qr_reorderer.FITXER_PROMETHEUS, list(METRIQUES_FITXERS.values()))
+    print(f"📤 '{nom}' ready for correction ({resum['pagines']} pages, {time.time() - inici:.1f}s).")
+    return True
+
+METRIQUES_FITXERS = {} # Last metrics of every file processed by this daemon (Prometheus textfile)
+
+def revisar_carpeta(estats):
+    """One pass over the input folder. 'estats' keeps, per PDF name, its last signature, since when it has
+    not changed, how many pages were read ahead and whether processing that exact version failed."""
+    ara = time.monotonic()
+    noms = sorted(f for f in os.listdir(qr_reorderer.CARPETA_ENTRADA) if f.lower().endswith('.pdf'))
+    for nom in set(estats) - set(noms): del estats[nom] # Deleted or renamed before it was processed
+
+    for nom in noms:
+        ruta_in = os.path.join(qr_reorderer.CARPETA_ENTRADA, nom)
+        if os.path.exists(os.path.join(qr_reorderer.CARPETA_SORTIDA, nom)):
+            estats.pop(nom, None) # Already processed (by this daemon or by a manual run)
+            continue
+        firma = firma_fitxer(ruta_in)
+        if firma is None: continue
+
+        estat = estats.get(nom)
+        if estat is None or estat["firma"] != firma:
+            if estat is None: print(f"👀 New scan: '{nom}'")
+            estats[nom] = {"firma": firma, "des_de": ara, "fallat": False,
+                           "prellegides": estat["prellegides"] if estat else 0}
+            if PRELECTURA: prellegir(ruta_in, nom, estats[nom])
+            continue
+        if estat["fallat"]: continue # Retried only if the file changes
+
+        repos = ara - estat["des_de"]
+        if repos < TEMPS_ESTABILITAT: continue
+        if not es_complet(ruta_in) and repos < TEMPS_MAXIM_INCOMPLET: continue
+
+        if processar_fitxer(nom):
+            del estats[nom]
+        else:
+            estat["fallat"] = True
+            print(f"⚠️ '{nom}' will be retried when it changes.")
+
+def main():
+    qr_reorderer.carregar_base_dades_alumnes()
+    qr_reorderer.carregar_estadistiques_cascada()
+    os.makedirs(qr_reorderer.CARPETA_ENTRADA, exist_ok=True)
+    os.makedirs(qr_reorderer.CARPETA_SORTIDA, exist_ok=True)
+    os.makedirs(CARPETA_PUNTS_CONTROL, exist_ok=True)
+
+    print(f"🛰️ Watching '{qr_reorderer.CARPETA_ENTRADA}' every {INTERVAL_SONDEIG:g}s (Ctrl+C to stop)...")
+    estats = {}
+    try:
+        while True:
+            revisar_carpeta(estats)
+            time.sleep(INTERVAL_SONDEIG)
+    except KeyboardInterrupt:
+        print("🛑 Stopped. Checkpoints are kept: pages already decoded will not be decoded again.")
+
+if __name__ == "__main__":
+    main()
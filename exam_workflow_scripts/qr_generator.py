@@ -6,6 +6,10 @@ from PIL import Image
 import shutil
 import json
 import sys
+import zipfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
 # Import from shared utility - now csv_utils
 from exam_workflow_scripts.csv_utils import load_students_from_csv_files
 
@@ -16,13 +20,25 @@ OUTPUT_EXAMS_DIR = "generated_exams"
 OUTPUT_ZIP_DIR = "zipped_exams"
 STUDENT_DATA_DIR = "student_data" # New directory for student CSVs
 
-MIDA_QR = 25
-POS_QR_X = 20
-POS_QR_Y = 800
+# QR size and position (points) live in qr_layout, shared with the reorderer
+from exam_workflow_scripts.qr_layout import MIDA_QR, POS_QR_X, POS_QR_Y
 
 FONT_TEXT = "helv"
 MIDA_TEXT = 12
 
+# Draw QR modules as a vector path (sharp at any print/scan resolution, no per-page bitmap).
+# False embeds a PNG per page, as older versions did.
+QR_VECTORIAL = True
+MIDA_CACHE_QR = 4096 # QR matrices kept in memory (one per distinct payload)
+
+# --- PRINT RUN ---
+# "fitxers": one PDF per student in OUTPUT_EXAMS_DIR, then a ZIP of that folder (previous behaviour)
+# "pdf": a single print-ready PDF with a bookmark per student
+# "zip": every student's PDF written straight into the ZIP, with no intermediate files
+MODE_TIRADA = "fitxers"
+NOM_TIRADA = "tots_els_examens" # Base name of the merged PDF / ZIP
+WORKERS_GENERACIO = None # Processes stamping exams in "pdf"/"zip" modes (None = one per CPU core, 1 = in-process)
+
 def generar_imatge_qr(dades):
     """Generates a QR code and returns it as bytes."""
     qr = qrcode.QRCode(box_size=10, border=0)
@@ -34,46 +50,173 @@ def generar_imatge_qr(dades):
     img.save(img_byte_arr, format='PNG')
     return img_byte_arr.getvalue()
 
-def generate_individual_exams(base_pdf_path, students_data, output_dir_for_exams): # Renamed parameter for clarity
+@lru_cache(maxsize=MIDA_CACHE_QR)
+def obtenir_matriu_qr(dades):
+    """QR modules (rows of booleans, True = dark) for 'dades'. Same encoder settings as generar_imatge_qr;
+    each payload is encoded only once per process."""
+    qr = qrcode.QRCode(border=0)
+    qr.add_data(dades)
+    qr.make(fit=True)
+    return tuple(tuple(fila) for fila in qr.get_matrix())
+
+@lru_cache(maxsize=MIDA_CACHE_QR)
+def cami_qr(dades):
+    """PDF path operators of the QR in module units: one 're' per horizontal run of dark modules."""
+    operadors = []
+    for y, fila in enumerate(obtenir_matriu_qr(dades)):
+        x = 0
+        while x < len(fila):
+            if not fila[x]:
+                x += 1
+                continue
+            inici = x
+            while x < len(fila) and fila[x]: x += 1
+            operadors.append(f"{inici} {y} {x - inici} 1 re\n")
+    return "".join(operadors)
+
+def dibuixar_qr_vectorial(page, rect, dades):
+    """Draws the QR as one filled path (no seams between modules), scaled to 'rect' by a single transform."""
+    n_moduls = len(obtenir_matriu_qr(dades))
+    shape = page.new_shape()
+    mat = fitz.Matrix(rect.width / n_moduls, 0, 0, rect.height / n_moduls, rect.x0, rect.y0) * shape.ipctm # modules -> PDF space
+    shape.draw_cont = "%g %g %g %g %g %g cm\n" % tuple(mat) + cami_qr(dades)
+    shape.finish(color=None, fill=(0, 0, 0), closePath=False)
+    shape.commit()
+
+def inserir_qr(page, rect, dades):
+    if QR_VECTORIAL:
+        dibuixar_qr_vectorial(page, rect, dades)
+    else:
+        page.insert_image(rect, stream=generar_imatge_qr(dades))
+
+def preparar_plantilla(base_pdf_path):
     """
-    Generates individual PDF exams for each student with their name and a unique QR code.
+    Parses the base PDF once: finds the name placeholders on every page, blanks them out and installs the
+    name font (all of it is the same for every student). Every copy is then stamped from this prepared template.
     """
-    os.makedirs(output_dir_for_exams, exist_ok=True) # Use renamed parameter
-    print(f"Processing {len(students_data)} exams...")
+    with fitz.open(base_pdf_path) as doc:
+        placeholders = []
+        for page in doc:
+            areas_trobades = page.search_for(TEXT_A_BUSCAR)
+            for rect in areas_trobades:
+                adjusted_rect = fitz.Rect(rect.x0, rect.y0 + 3, rect.x1, rect.y1 - 3)
+                page.draw_rect(adjusted_rect, color=(1, 1, 1), fill=(1, 1, 1))
+            if areas_trobades: page.insert_font(fontname=FONT_TEXT) # Font resource and glyph widths computed once
+            placeholders.append(areas_trobades)
+        return {"bytes": doc.tobytes(), "placeholders": placeholders, "fonts": doc.FontInfos}
+
+def estampar_examen(plantilla, alumne):
+    """Returns a new in-memory document with the student's name and per-page QR codes stamped on the template."""
+    doc = fitz.open(stream=plantilla["bytes"], filetype="pdf")
+    doc.FontInfos = [list(info) for info in plantilla["fonts"]] # Same xrefs as in the template: skips re-measuring the font
+    rect_qr = fitz.Rect(POS_QR_X, POS_QR_Y, POS_QR_X + MIDA_QR, POS_QR_Y + MIDA_QR)
 
+    for page_num, (page, areas_trobades) in enumerate(zip(doc, plantilla["placeholders"])):
+        # Write the student name over the (already blanked) placeholders
+        for rect in areas_trobades:
+            page.insert_text((rect.x0, rect.y1 - 2), alumne['nom'], fontsize=MIDA_TEXT, fontname=FONT_TEXT, color=(0, 0, 0))
+
+        # Insert QR code
+        qr_content = f'{alumne["id"]}-{page_num + 1}'
+        inserir_qr(page, rect_qr, qr_content)
+    return doc
+
+def nom_fitxer_examen(alumne):
+    return f"Examen_{alumne['nom'].replace(' ', '_')}.pdf"
+
+def carregar_plantilla(base_pdf_path):
     if not os.path.exists(base_pdf_path):
         raise FileNotFoundError(f"Base PDF file not found: '{base_pdf_path}'. Please ensure it exists.")
 
     try:
-        doc_test = fitz.open(base_pdf_path)
-        doc_test.close()
+        return preparar_plantilla(base_pdf_path) # Template parsed once for the whole roster
     except Exception as e:
         raise Exception(f"Error opening base PDF file '{base_pdf_path}': {e}")
 
-    for alumne in students_data:
-        doc = fitz.open(base_pdf_path) # Open a fresh copy for each student
-
-        for page_num, page in enumerate(doc):
-            # Find and replace student name placeholder
-            areas_trobades = page.search_for(TEXT_A_BUSCAR)
-            for rect in areas_trobades:
-                adjusted_rect = fitz.Rect(rect.x0, rect.y0 + 3, rect.x1, rect.y1 - 3)
-                page.draw_rect(adjusted_rect, color=(1, 1, 1), fill=(1, 1, 1))
-                page.insert_text((rect.x0, rect.y1 - 2), alumne['nom'], fontsize=MIDA_TEXT, fontname=FONT_TEXT, color=(0, 0, 0))
+def generate_individual_exams(base_pdf_path, students_data, output_dir_for_exams): # Renamed parameter for clarity
+    """
+    Generates individual PDF exams for each student with their name and a unique QR code.
+    """
+    os.makedirs(output_dir_for_exams, exist_ok=True) # Use renamed parameter
+    print(f"Processing {len(students_data)} exams...")
+    plantilla = carregar_plantilla(base_pdf_path)
 
-            # Insert QR code
-            qr_content = f'{alumne["id"]}-{page_num + 1}'
-            qr_bytes = generar_imatge_qr(qr_content)
-            rect_qr = fitz.Rect(POS_QR_X, POS_QR_Y, POS_QR_X + MIDA_QR, POS_QR_Y + MIDA_QR)
-            page.insert_image(rect_qr, stream=qr_bytes)
+    for alumne in students_data:
+        doc = estampar_examen(plantilla, alumne)
 
         # Save the modified PDF
-        nom_fitxer = f"Examen_{alumne['nom'].replace(' ', '_')}.pdf"
+        nom_fitxer = nom_fitxer_examen(alumne)
         path_sortida = os.path.join(output_dir_for_exams, nom_fitxer) # Use renamed parameter
         doc.save(path_sortida)
         doc.close()
         print(f"✅ Generated: {nom_fitxer}")
 
+# Prepared template of a generation worker (set once by its initializer)
+PLANTILLA_WORKER = None
+
+def inicialitzar_worker_generacio(plantilla):
+    global PLANTILLA_WORKER
+    PLANTILLA_WORKER = plantilla
+
+def estampar_examen_bytes(alumne):
+    """Worker task: one student's exam as PDF bytes (nothing touches the disk)."""
+    doc = estampar_examen(PLANTILLA_WORKER, alumne)
+    try:
+        return doc.tobytes()
+    finally:
+        doc.close()
+
+def generar_examens_paralel(plantilla, students_data, workers):
+    """Yields (student, PDF bytes) in roster order, stamped in a process pool (or in-process if workers == 1)."""
+    if workers <= 1 or len(students_data) <= 1:
+        inicialitzar_worker_generacio(plantilla)
+        for alumne in students_data:
+            yield alumne, estampar_examen_bytes(alumne)
+        return
+
+    context = multiprocessing.get_context("spawn") # Same start method as the reorderer's pools
+    mida_tasca = max(1, len(students_data) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                             initializer=inicialitzar_worker_generacio, initargs=(plantilla,)) as executor:
+        yield from zip(students_data, executor.map(estampar_examen_bytes, students_data, chunksize=mida_tasca))
+
+def generar_tirada(base_pdf_path, students_data, output_dir, mode=None, workers=None):
+    """
+    Print-run mode: stamps every student's exam in a worker pool and writes a single output, either one
+    merged PDF with a bookmark per student (mode "pdf") or a ZIP fed with each PDF as it arrives (mode "zip").
+    Returns the path of the file written.
+    """
+    mode = mode or MODE_TIRADA
+    if mode not in ("pdf", "zip"):
+        raise ValueError(f"Unknown print-run mode '{mode}' (expected 'pdf' or 'zip').")
+    workers = WORKERS_GENERACIO if workers is None else workers
+    workers = workers or os.cpu_count() or 1
+    os.makedirs(output_dir, exist_ok=True)
+    plantilla = carregar_plantilla(base_pdf_path)
+    ruta_sortida = os.path.join(output_dir, f"{NOM_TIRADA}.{mode}")
+    ruta_tmp = ruta_sortida + ".part" # A half-written print run never replaces a good one
+    print(f"Processing {len(students_data)} exams ({workers} workers, mode '{mode}')...")
+
+    if mode == "zip":
+        with zipfile.ZipFile(ruta_tmp, "w", zipfile.ZIP_DEFLATED) as arxiu_zip:
+            for alumne, pdf_bytes in generar_examens_paralel(plantilla, students_data, workers):
+                arxiu_zip.writestr(nom_fitxer_examen(alumne), pdf_bytes)
+                print(f"✅ Generated: {nom_fitxer_examen(alumne)}")
+    else:
+        tirada, index = fitz.open(), []
+        for alumne, pdf_bytes in generar_examens_paralel(plantilla, students_data, workers):
+            with fitz.open(stream=pdf_bytes, filetype="pdf") as examen:
+                index.append([1, alumne['nom'], tirada.page_count + 1]) # Bookmark to the student's first page
+                tirada.insert_pdf(examen)
+            print(f"✅ Generated: {nom_fitxer_examen(alumne)}")
+        tirada.set_toc(index)
+        tirada.save(ruta_tmp, garbage=3, deflate=True) # Merges the template objects repeated in every copy
+        tirada.close()
+
+    os.replace(ruta_tmp, ruta_sortida)
+    print(f"✅ Print run saved to: {ruta_sortida}")
+    return ruta_sortida
+
 def create_zip_of_exams(exams_dir, output_dir_for_zip): # Renamed parameter for clarity
     """
     Creates a ZIP archive of all generated exams.
@@ -112,13 +255,19 @@ if __name__ == "__main__":
         sys.exit(1)
 
     try:
-        generate_individual_exams(base_pdf_template_path, alumnes_data, output_exams_absolute_path) # Pass the absolute path
-        zip_file_path = create_zip_of_exams(output_exams_absolute_path, output_zip_absolute_path) # Pass the absolute path
-        
-        if zip_file_path:
-            print(f"Process completed. All exams generated and zipped to {zip_file_path}")
+        if MODE_TIRADA != "fitxers":
+            # Single output file, no per-student PDFs on disk
+            carpeta_tirada = output_zip_absolute_path if MODE_TIRADA == "zip" else output_exams_absolute_path
+            ruta_tirada = generar_tirada(base_pdf_template_path, alumnes_data, carpeta_tirada)
+            print(f"Process completed. All exams written to {ruta_tirada}")
         else:
-            print("Process completed with errors.")
+            generate_individual_exams(base_pdf_template_path, alumnes_data, output_exams_absolute_path) # Pass the absolute path
+            zip_file_path = create_zip_of_exams(output_exams_absolute_path, output_zip_absolute_path) # Pass the absolute path
+
+            if zip_file_path:
+                print(f"Process completed. All exams generated and zipped to {zip_file_path}")
+            else:
+                print("Process completed with errors.")
 
     except Exception as e:
         print(f"An unexpected error occurred: {e}", file=sys.stderr)
\ No newline at end of file
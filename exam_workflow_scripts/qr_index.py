@@ -0,0 +1,185 @@
+import fitz # PyMuPDF
+import json
+import os
+import sqlite3
+import sys
+import time
+
+# --- CONFIGURATION ---
+# Default index file (qr_reorderer.FITXER_INDEX_PAGINES is the one the reorderer writes)
+FITXER_INDEX = "qr_page_index.sqlite"
+
+# One connection per process and index file (pool workers open their own)
+_CONNEXIONS = {}
+
+def obrir(ruta):
+    if ruta not in _CONNEXIONS:
+        carpeta = os.path.dirname(ruta)
+        if carpeta: os.makedirs(carpeta, exist_ok=True)
+        conn = sqlite3.connect(ruta, timeout=30)
+        conn.execute("PRAGMA journal_mode=WAL") # Several reorderer processes can write batches at the same time
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS lots (
+                lot TEXT PRIMARY KEY, nom TEXT NOT NULL, pagines INTEGER NOT NULL, data REAL NOT NULL);
+            CREATE TABLE IF NOT EXISTS pagines (
+                lot TEXT NOT NULL, nova_pagina INTEGER NOT NULL, pagina_original INTEGER,
+                alumne_id TEXT, alumne_nom TEXT, pagina_examen INTEGER, grup INTEGER, metode TEXT, especial TEXT,
+                PRIMARY KEY (lot, nova_pagina));
+            CREATE INDEX IF NOT EXISTS idx_pagines_alumne ON pagines (alumne_id, pagina_examen, lot);
+            CREATE INDEX IF NOT EXISTS idx_pagines_grup ON pagines (grup, alumne_nom, pagina_examen);
+        """)
+        _CONNEXIONS[ruta] = conn
+    return _CONNEXIONS[ruta]
+
+# ==============================================================================
+# 1. WRITING
+# ==============================================================================
+def clau_lot(ruta_pdf):
+    """A batch is keyed by the absolute path of its reordered PDF: scanner file names (scan0001.pdf) get reused
+    from one session to the next, but an output path is only written again when that batch is reprocessed."""
+    return os.path.abspath(ruta_pdf)
+
+def substituir_lot(conn, ruta_pdf, files):
+    """Replaces every row of a batch in one transaction: a reprocessed batch never leaves stale pages behind.
+    'files' are the page rows without their batch column."""
+    lot = clau_lot(ruta_pdf)
+    with conn:
+        conn.execute("DELETE FROM pagines WHERE lot = ?", (lot,))
+        conn.executemany("INSERT INTO pagines VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", [(lot, *fila) for fila in files])
+        conn.execute("INSERT OR REPLACE INTO lots VALUES (?, ?, ?, ?)", (lot, os.path.basename(ruta_pdf), len(files), time.time()))
+
+def guardar_lot(ruta, ruta_pdf, pages_info):
+    """Indexes one reordered PDF. 'pages_info' is in output order (as the reorderer writes it)."""
+    files = [(nova_pagina, p["idx"], p["id"], p["nom"], p["pag_num"] if p["id"] is not None else None,
+              p["sort"][0], p["metode"], p.get("especial")) for nova_pagina, p in enumerate(pages_info)]
+    try:
+        substituir_lot(obrir(ruta), ruta_pdf, files)
+    except sqlite3.Error as e:
+        print(f"⚠️ Could not write '{os.path.basename(ruta_pdf)}' to the page index ({e}).", file=sys.stderr)
+
+def importar_mapes(ruta, carpeta):
+    """Indexes the JSON maps already in 'carpeta' (batches reordered before the index existed).
+    Their PDFs are expected next to them; the original page order and method are unknown (NULL)."""
+    conn = obrir(ruta)
+    importats = 0
+    for nom in sorted(os.listdir(carpeta)):
+        if not nom.endswith(".json") or nom.endswith(".metrics.json"): continue
+        ruta_pdf = os.path.join(carpeta, nom[:-len(".json")] + ".pdf")
+        if not os.path.exists(ruta_pdf): continue
+        with open(os.path.join(carpeta, nom), "r", encoding="utf-8") as f:
+            mapa = json.load(f)
+        files = [(e["nova_pagina_pdf"], None, e["alumne_id"], e["alumne_nom"],
+                  e["pagina_examen"] if e["alumne_id"] is not None else None, None, None, None) for e in mapa]
+        substituir_lot(conn, ruta_pdf, files)
+        importats += 1
+    print(f"📥 Imported {importats} JSON maps from '{carpeta}'.")
+    return importats
+
+# ==============================================================================
+# 2. QUERIES
+# ==============================================================================
+def pagines_alumne(ruta, alumne_id):
+    """Every indexed page of a student: [(exam page, batch PDF, page in that PDF, method)], by exam page."""
+    return obrir(ruta).execute(
+        "SELECT pagina_examen, lot, nova_pagina, metode FROM pagines WHERE alumne_id = ? ORDER BY pagina_examen, lot, nova_pagina",
+        (alumne_id,)).fetchall()
+
+def pagines_que_falten(ruta, alumne_id=None):
+    """Global audit: {student_id: missing exam pages} over all batches. Like auditoria_final, the expected pages
+    are the range between the lowest and highest page seen; only students with a gap are read page by page."""
+    conn = obrir(ruta)
+    filtre, parametres = ("AND alumne_id = ?", (alumne_id,)) if alumne_id else ("", ())
+    amb_forats = conn.execute(f"""
+        SELECT alumne_id, MIN(pagina_examen), MAX(pagina_examen) FROM pagines
+        WHERE alumne_id IS NOT NULL AND pagina_examen < 999 {filtre}
+        GROUP BY alumne_id HAVING COUNT(DISTINCT pagina_examen) < MAX(pagina_examen) - MIN(pagina_examen) + 1""", parametres).fetchall()
+    faltes = {}
+    for id_alumne, minim, maxim in amb_forats:
+        vistes = {fila[0] for fila in conn.execute("SELECT DISTINCT pagina_examen FROM pagines WHERE alumne_id = ?", (id_alumne,))}
+        faltes[id_alumne] = sorted(set(range(minim, maxim + 1)) - vistes)
+    return faltes
+
+def pagines_repetides(ruta):
+    """Exam pages found more than once (double scans, or the same sheet in two batches):
+    {(student_id, exam page): [(batch PDF, page in that PDF)]}."""
+    conn = obrir(ruta)
+    repetides = {}
+    for id_alumne, pagina, lot, nova_pagina in conn.execute("""
+            SELECT p.alumne_id, p.pagina_examen, p.lot, p.nova_pagina FROM pagines p
+            JOIN (SELECT alumne_id, pagina_examen FROM pagines WHERE alumne_id IS NOT NULL
+                  GROUP BY alumne_id, pagina_examen HAVING COUNT(*) > 1) r
+              ON p.alumne_id = r.alumne_id AND p.pagina_examen = r.pagina_examen
+            ORDER BY p.alumne_id, p.pagina_examen, p.lot, p.nova_pagina"""):
+        repetides.setdefault((id_alumne, pagina), []).append((lot, nova_pagina))
+    return repetides
+
+def pagines_grup(ruta, index_grup):
+    """Pages of one GRUPS_PAGINES group across all batches, in correction order:
+    [(student name, exam page, batch PDF, page in that PDF)]. Double scans are left out (their original is there)."""
+    return obrir(ruta).execute("""
+        SELECT alumne_nom, pagina_examen, lot, nova_pagina FROM pagines
+        WHERE grup = ? AND alumne_id IS NOT NULL AND especial IS NULL ORDER BY alumne_nom, pagina_examen, lot""", (index_grup,)).fetchall()
+
+# ==============================================================================
+# 3. EXPORTS
+# ==============================================================================
+def extreure_grup(ruta, index_grup, ruta_sortida):
+    """Writes one PDF with the pages of a group from every batch (e.g. all copies of questions 5-6 for one corrector)."""
+    pagines = pagines_grup(ruta, index_grup)
+    sortida, oberts = fitz.open(), {}
+    try:
+        for _, _, ruta_pdf, nova_pagina in pagines:
+            if ruta_pdf not in oberts: oberts[ruta_pdf] = fitz.open(ruta_pdf)
+            sortida.insert_pdf(oberts[ruta_pdf], from_page=nova_pagina, to_page=nova_pagina)
+        if not pagines: sortida.new_page() # A PDF needs at least one page
+        sortida.save(ruta_sortida + ".part", garbage=3)
+    finally:
+        sortida.close()
+        for doc in oberts.values(): doc.close()
+    os.replace(ruta_sortida + ".part", ruta_sortida)
+    print(f"📄 Group {index_grup}: {len(pagines)} pages written to '{ruta_sortida}'.")
+    return len(pagines)
+
+def exportar_json(ruta, ruta_pdf, ruta_json):
+    """Writes the JSON map of one reordered PDF (same format as the reorderer's) from the index."""
+    files = obrir(ruta).execute("SELECT nova_pagina, alumne_id, alumne_nom, pagina_examen FROM pagines WHERE lot = ? ORDER BY nova_pagina",
+                                (clau_lot(ruta_pdf),)).fetchall()
+    mapa = [{"nova_pagina_pdf": nova_pagina, "alumne_id": id_alumne, "alumne_nom": nom,
+             "pagina_examen": pagina if pagina is not None else 9999} for nova_pagina, id_alumne, nom, pagina in files]
+    with open(ruta_json + ".part", "w", encoding="utf-8") as f:
+        json.dump(mapa, f, indent=4, ensure_ascii=False)
+    os.replace(ruta_json + ".part", ruta_json)
+    return len(mapa)
+
+# ==============================================================================
+# 4. COMMAND LINE
+# ==============================================================================
+def ordre_falten(alumne_id=None):
+    faltes = pagines_que_falten(FITXER_INDEX, alumne_id)
+    for id_alumne, pagines in sorted(faltes.items()):
+        print(f"⚠️ {id_alumne}: Missing pages {pagines}")
+    if not faltes: print("✅ No missing pages across the indexed batches.")
+
+def ordre_alumne(alumne_id):
+    for pagina, lot, nova_pagina, metode in pagines_alumne(FITXER_INDEX, alumne_id):
+        print(f"P.{pagina:<4} {os.path.basename(lot)} (page {nova_pagina + 1}) [{metode}]")
+
+def ordre_repetides():
+    for (id_alumne, pagina), llocs in sorted(pagines_repetides(FITXER_INDEX).items()):
+        print(f"♊ {id_alumne} P.{pagina}: " + ", ".join(f"{os.path.basename(lot)} (page {n + 1})" for lot, n in llocs))
+
+ORDRES = {
+    "falten": ordre_falten,
+    "alumne": ordre_alumne,
+    "repetides": ordre_repetides,
+    "grup": lambda index_grup, ruta_sortida: extreure_grup(FITXER_INDEX, int(index_grup), ruta_sortida),
+    "exportar": lambda ruta_pdf, ruta_json: exportar_json(FITXER_INDEX, ruta_pdf, ruta_json),
+    "importar": lambda carpeta: importar_mapes(FITXER_INDEX, carpeta),
+}
+
+if __name__ == "__main__":
+    # Usage: python -m exam_workflow_scripts.qr_index <command> <args...>
+    if len(sys.argv) < 2 or sys.argv[1] not in ORDRES:
+        print(f"Usage: python -m exam_workflow_scripts.qr_index [{'|'.join(ORDRES)}] <args...>", file=sys.stderr)
+        sys.exit(1)
+    ORDRES[sys.argv[1]](*sys.argv[2:])
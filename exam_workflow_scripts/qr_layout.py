@@ -0,0 +1,21 @@
+import fitz # PyMuPDF
+import os
+
+# --- QR PLACEMENT (points from the top-left corner of the template page) ---
+# Stamped there by qr_generator; qr_reorderer starts looking for the QR at the same spot.
+MIDA_QR = 25
+POS_QR_X = 20
+POS_QR_Y = 800
+
+# --- TEMPLATE ---
+# Template bundled with the scripts (the one the exams are generated from)
+RUTA_PLANTILLA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates", "base.pdf")
+MIDA_PAGINA_DEFECTE = (595, 842) # A4, used when the template cannot be read
+
+def mida_pagina(ruta_plantilla):
+    """Size in points (width, height) of the first page of a template PDF."""
+    try:
+        with fitz.open(ruta_plantilla) as doc:
+            return (doc[0].rect.width, doc[0].rect.height)
+    except Exception:
+        return MIDA_PAGINA_DEFECTE
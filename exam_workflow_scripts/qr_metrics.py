@@ -0,0 +1,127 @@
+import json
+import os
+import time
+from collections import Counter
+
+# Record of the page being decoded in this process. None = metrics off: every hook returns straight away.
+_PAGINA = None
+
+def iniciar_pagina():
+    global _PAGINA
+    _PAGINA = {"etapes": {}, "intents": {}}
+
+def tancar_pagina():
+    """Closes the open page record and returns it: seconds per stage and decoder attempts per engine."""
+    global _PAGINA
+    registre, _PAGINA = _PAGINA, None
+    return registre
+
+def rellotge():
+    """Start time for sumar(), or None when no page record is open."""
+    return time.perf_counter() if _PAGINA is not None else None
+
+def sumar(etapa, inici):
+    if inici is None: return
+    afegir(_PAGINA, etapa, time.perf_counter() - inici)
+
+def afegir(registre, etapa, segons):
+    registre["etapes"][etapa] = registre["etapes"].get(etapa, 0.0) + segons
+
+def comptar_intent(motor, registre=None):
+    registre = registre if registre is not None else _PAGINA
+    if registre is None: return
+    registre["intents"][motor] = registre["intents"].get(motor, 0) + 1
+
+def repartir_lot(registre, registres):
+    """Shares the stage times of a batched step evenly among the page records taking part in it."""
+    for etapa, segons in registre["etapes"].items():
+        for r in registres:
+            afegir(r, etapa, segons / len(registres))
+
+def percentil(valors_ordenats, q):
+    if not valors_ordenats: return 0.0
+    return valors_ordenats[min(len(valors_ordenats) - 1, int(q * len(valors_ordenats)))]
+
+def metriques_fitxer(nom_fitxer, pages_info, etapes_fitxer):
+    """Per-page records (latency, attempts, winning strategy, stage times) and their totals for one PDF."""
+    pagines, etapes, intents, guanyadores = [], Counter(), Counter(), Counter()
+    for p in sorted(pages_info, key=lambda x: x["idx"]):
+        registre = p.get("metriques") or {"etapes": {}, "intents": {}}
+        etapes.update(registre["etapes"])
+        intents.update(registre["intents"])
+        if registre.get("estrategia"): guanyadores[registre["estrategia"]] += 1
+        pagines.append({
+            "idx": p["idx"], "latencia": p["temps_deteccio"], "nivell": p["nivell"],
+            "estrategia": registre.get("estrategia"), "metode_final": p["metode"],
+            "intents": sum(registre["intents"].values()), "intents_per_motor": registre["intents"],
+            "etapes": registre["etapes"],
+        })
+
+    latencies = sorted(p["latencia"] for p in pagines)
+    return {
+        "fitxer": nom_fitxer,
+        "data": time.time(),
+        "pagines": len(pagines),
+        "fallades": sum(1 for p in pages_info if p["id"] is None and p.get("especial") != "blanca"),
+        "blanques": sum(1 for p in pages_info if p.get("especial") == "blanca"),
+        "duplicats": sum(1 for p in pages_info if p.get("especial") == "duplicat"),
+        "latencia": {
+            "total": sum(latencies), "p50": percentil(latencies, 0.5), "p90": percentil(latencies, 0.9),
+            "p99": percentil(latencies, 0.99), "max": latencies[-1] if latencies else 0.0,
+        },
+        "intents": sum(intents.values()),
+        "intents_per_motor": dict(intents),
+        "estrategies_guanyadores": dict(guanyadores.most_common()),
+        "etapes_pagina": dict(etapes), # Summed over pages (part of 'lectura_qr')
+        "etapes_fitxer": etapes_fitxer,
+        "detall_pagines": pagines,
+    }
+
+def guardar_json(ruta, metriques):
+    with open(ruta + ".part", "w", encoding="utf-8") as f:
+        json.dump(metriques, f, indent=4, ensure_ascii=False)
+    os.replace(ruta + ".part", ruta)
+
+def etiquetes(**valors):
+    escapats = {k: str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for k, v in valors.items()}
+    return "{" + ",".join(f'{k}="{v}"' for k, v in escapats.items()) + "}"
+
+def guardar_prometheus(ruta, metriques_fitxers):
+    """Writes the run's metrics in the Prometheus text format, for node_exporter's textfile collector.
+    The file is replaced atomically, so the collector never scrapes a half-written file."""
+    linies = [
+        "# HELP qr_reorder_pages_total Pages in the scanned PDF.", "# TYPE qr_reorder_pages_total gauge",
+        *(f"qr_reorder_pages_total{etiquetes(file=m['fitxer'])} {m['pagines']}" for m in metriques_fitxers),
+        "# HELP qr_reorder_failed_pages_total Pages left without a student.", "# TYPE qr_reorder_failed_pages_total gauge",
+        *(f"qr_reorder_failed_pages_total{etiquetes(file=m['fitxer'])} {m['fallades']}" for m in metriques_fitxers),
+        "# HELP qr_reorder_set_apart_pages_total Blank and double-scanned pages (not decoded).", "# TYPE qr_reorder_set_apart_pages_total gauge",
+        *(f"qr_reorder_set_apart_pages_total{etiquetes(file=m['fitxer'], kind=tipus)} {m[clau]}"
+          for m in metriques_fitxers for tipus, clau in (("blank", "blanques"), ("duplicate", "duplicats"))),
+        "# HELP qr_reorder_decode_attempts_total Decoder attempts per engine.", "# TYPE qr_reorder_decode_attempts_total gauge",
+    ]
+    for m in metriques_fitxers:
+        linies += [f"qr_reorder_decode_attempts_total{etiquetes(file=m['fitxer'], engine=motor)} {n}"
+                   for motor, n in sorted(m["intents_per_motor"].items())]
+    linies += ["# HELP qr_reorder_strategy_wins_total Pages decoded by each strategy.", "# TYPE qr_reorder_strategy_wins_total gauge"]
+    for m in metriques_fitxers:
+        linies += [f"qr_reorder_strategy_wins_total{etiquetes(file=m['fitxer'], strategy=estrategia)} {n}"
+                   for estrategia, n in m["estrategies_guanyadores"].items()]
+    linies += ["# HELP qr_reorder_stage_seconds Time spent per stage (page stages are part of lectura_qr).",
+               "# TYPE qr_reorder_stage_seconds gauge"]
+    for m in metriques_fitxers:
+        for etapa, segons in sorted({**m["etapes_pagina"], **m["etapes_fitxer"]}.items()):
+            linies.append(f"qr_reorder_stage_seconds{etiquetes(file=m['fitxer'], stage=etapa)} {segons:.6f}")
+    linies += ["# HELP qr_reorder_page_latency_seconds Detection time per page.", "# TYPE qr_reorder_page_latency_seconds summary"]
+    for m in metriques_fitxers:
+        for q in ("p50", "p90", "p99"):
+            linies.append(f"qr_reorder_page_latency_seconds{etiquetes(file=m['fitxer'], quantile=int(q[1:]) / 100)} {m['latencia'][q]:.6f}")
+        linies.append(f"qr_reorder_page_latency_seconds_sum{etiquetes(file=m['fitxer'])} {m['latencia']['total']:.6f}")
+        linies.append(f"qr_reorder_page_latency_seconds_count{etiquetes(file=m['fitxer'])} {m['pagines']}")
+    linies += ["# HELP qr_reorder_last_run_timestamp_seconds End of the last run.", "# TYPE qr_reorder_last_run_timestamp_seconds gauge",
+               f"qr_reorder_last_run_timestamp_seconds {time.time():.0f}"]
+
+    carpeta = os.path.dirname(ruta)
+    if carpeta: os.makedirs(carpeta, exist_ok=True)
+    with open(ruta + ".part", "w", encoding="utf-8") as f:
+        f.write("\n".join(linies) + "\n")
+    os.replace(ruta + ".part", ruta)
@@ -1,21 +1,130 @@
 import fitz # PyMuPDF
-from PIL import Image
 import numpy as np
 import cv2
-import io
 import os
 import time
 from collections import defaultdict
 import json
 import sys
+import math
+import importlib.util
+from collections import Counter
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 
 # Import shared utility for loading student data
-from exam_workflow_scripts.csv_utils import load_students_from_csv_files
+from exam_workflow_scripts.csv_utils import load_roster_index, nearest_student_id
+# QR placement shared with the generator (points on the template page)
+from exam_workflow_scripts.qr_layout import POS_QR_X, POS_QR_Y, MIDA_QR, RUTA_PLANTILLA, mida_pagina
+from exam_workflow_scripts import qr_cache, qr_index, qr_metrics
 
 # --- CONFIGURATION ---
 DPI_DETECCIO = 300 # High quality for QR detection
-DPI_SORTIDA = 150  # Output PDF DPI
-QUALITAT_JPG = 80  # Quality for JPG conversion when inserting images into new PDF
+# Output mode: "copia" copies the original page objects in the new order (lossless, no re-encoding);
+# "raster" re-renders every page at DPI_SORTIDA and stores it as a JPG
+MODE_SORTIDA = "copia"
+DPI_SORTIDA = 150  # Output PDF DPI ("raster" mode only)
+QUALITAT_JPG = 80  # Quality for JPG conversion when inserting images into new PDF ("raster" mode only)
+
+# --- STREAMING (bounded memory for very large scan batches) ---
+# Pages are decoded and written in windows of MIDA_FINESTRA pages. The source PDF is reopened for each
+# window and the output is appended with incremental saves, so peak memory does not depend on batch size.
+MODE_STREAMING = False
+MIDA_FINESTRA = 50
+
+# --- MULTI-RESOLUTION DETECTION (coarse to fine) ---
+# Each page is first rendered at these DPIs (lowest first) and given one cheap decode attempt.
+# Only the pages that fail every tier are rendered at DPI_DETECCIO and go through the full battery.
+# Use [] to always run the full battery at DPI_DETECCIO.
+NIVELLS_DPI = [120, 200]
+
+# --- ADAPTIVE DECODER CASCADE (full battery) ---
+# Angles tried by the battery (degrees)
+ANGLES_BATERIA = [0, 90, 180, 270, 5, -5, 10, -10]
+# Initial guesses used until a strategy has been measured: cost per attempt (seconds per megapixel)
+# and success rate (upright pages are by far the most common)
+COST_INICIAL_MOTOR = {"Pyzbar": 0.02, "OpenCV": 0.04, "QReader": 0.15}
+EXIT_INICIAL_ANGLE = {"auto": 0.7, 0: 0.5, 90: 0.2, 180: 0.2, 270: 0.2}
+EXIT_INICIAL_ALTRES = 0.1
+# JSON file where the per-strategy statistics are kept between runs (None = do not persist)
+FITXER_ESTADISTIQUES_CASCADA = None
+# QReader is kept out of the per-page battery: pages that every cheap engine failed on are collected
+# and sent to the neural detector together, MIDA_LOT_QREADER images per model call
+QREADER_PER_LOTS = True
+MIDA_LOT_QREADER = 8
+
+# --- ORIENTATION AND SKEW ---
+ORIENTACIO_AUTOMATICA = True  # Estimate the page rotation once (QR finder patterns, else text lines) before the battery
+ORIENTACIO_PER_LOT = True     # Assume the scanner feed orientation found on the first pages of each PDF
+ORIENTACIO_MOSTRES_LOT = 3    # Pages used to fix the feed orientation of a batch
+ORIENTACIO_FORCA_BRUTA = True # If the estimated angles fail, still try the rest of ANGLES_BATERIA
+
+# --- QR REGION OF INTEREST ---
+# The generator stamps every QR at the same spot, so detection starts on a small crop around it.
+# The window is then re-centred on where the first decodes of each PDF are really found (scanner offset).
+# A page whose crop fails falls back to a full-page search.
+MIDA_PAGINA_PLANTILLA = mida_pagina(RUTA_PLANTILLA) # Template page size in points (A4 if it cannot be read)
+ZONA_QR = {
+    "activat": True,
+    "x1": POS_QR_X / MIDA_PAGINA_PLANTILLA[0],
+    "y1": POS_QR_Y / MIDA_PAGINA_PLANTILLA[1],
+    "x2": (POS_QR_X + MIDA_QR) / MIDA_PAGINA_PLANTILLA[0],
+    "y2": (POS_QR_Y + MIDA_QR) / MIDA_PAGINA_PLANTILLA[1],
+    "marge_seguretat": 0.05,   # Added on every side, as a fraction of the page
+    "aprendre": True,          # Re-centre the window on the observed QR position
+    "mostres_aprenentatge": 5, # Successful decodes used to learn the position
+}
+
+# --- PREDICTIVE VERIFICATION ---
+# Scanner batches are runs of ID-1, ID-2, ... per student. Once a page is read, the next one is expected to
+# carry the next payload at the same spot: a single quick decode of a tight crop at the same DPI checks it,
+# and the full coarse-to-fine search only runs when that check fails.
+MODE_PREDICTIU = True
+MARGE_VERIFICACIO = 1.0 # Margin added around the last QR box, as a fraction of its side (OpenCV needs a quiet zone)
+
+# --- BLANK AND DOUBLE-SCANNED PAGES ---
+# Pages the quick tiers cannot read are rendered once at low resolution before the full battery: blank pages
+# (scanned back sides) skip it and go to their own bucket at the end of the output.
+# Once every page is decoded, a page carrying the same QR payload as an earlier page of the batch, or an unreadable
+# page showing the same sheet as a recent unreadable one, is a second scan of that sheet (feeder double scan).
+# Duplicates follow their original.
+PREPAS_PAGINES = True
+DPI_PREPAS = 72
+LLINDAR_TINTA_BLANCA = 0.0004    # Fraction of dark pixels below which a page is blank (a page with only a QR has ~0.0012)
+DISTANCIA_HASH_DUPLICAT = 6      # Perceptual hashes (64 bits) closer than this make two unreadable pages duplicate candidates
+LLINDAR_DIFERENCIA_DUPLICAT = 70 # Candidates are aligned and compared in 4x4 pixel blocks, the whole page at DPI_PREPAS and the
+                                 # QR window at DPI_DETECCIO (where the QR modules resolve): above this grey-level difference
+                                 # anywhere (a different answer, a different QR), they are different sheets
+FINESTRA_DUPLICATS = 3           # How many pages back an unreadable page is compared with
+
+# --- PARALLEL QR READING (Phase 1) ---
+# Number of worker processes used to decode pages (1 = sequential, None = one per CPU core)
+WORKERS_DETECCIO = 1
+# Pages handed to a worker in one go. Each worker opens the PDF itself and decodes its range.
+PAGINES_PER_TASCA = 16
+# Number of PDFs processed at the same time by main() (None = one per CPU core).
+# When several files run in parallel, each file decodes its pages sequentially.
+WORKERS_FITXERS = None
+
+# --- DECODE CACHE ---
+# SQLite file keeping the decode result of every page seen, keyed by page content + detector settings
+# (None = disabled). Re-runs after a roster or GRUPS_PAGINES change skip Phase 1 for pages already read.
+FITXER_CACHE_DECODIFICACIO = "qr_decode_cache.sqlite"
+
+# --- PAGE INDEX ---
+# SQLite file indexing every page of every reordered PDF by student, exam page and batch (None = disabled).
+# Audits, per-student lookups and per-group extraction across batches query it (see qr_index).
+# The JSON maps are still written next to each PDF as an export.
+FITXER_INDEX_PAGINES = "qr_page_index.sqlite"
+
+# --- METRICS ---
+# Per-page latency, decoder attempts, winning strategy and time per stage (render, orientation, preprocessing,
+# decoding, cache, deduction, writing), saved as <output>.metrics.json next to each JSON map.
+# When off, the timing hooks return straight away.
+METRIQUES = False
+# Prometheus textfile (e.g. for node_exporter's textfile collector, must end in .prom), rewritten at the end
+# of every run with the totals of the files processed (None = disabled; needs METRIQUES)
+FITXER_PROMETHEUS = None
 
 # --- DIRECTORY PATHS (These should be configurable, possibly via environment variables or a config file) ---
 # Input folder for raw scanned PDFs
@@ -35,8 +144,11 @@ GRUPS_PAGINES = [[4], [5,6], [7,8], [9,10], [11,12]]
 # 1. STUDENT DATA LOADING
 # ==============================================================================
 DICCIONARI_ALUMNES = {}
-def carregar_base_dades_alumnes():
-    global DICCIONARI_ALUMNES
+INDEX_ALUMNES = None # Roster index (csv_utils.build_roster_index): lookups by ID/file/email and nearest-ID search
+def carregar_base_dades_alumnes(sortir_si_buida=True):
+    """(Re)builds DICCIONARI_ALUMNES from the CSVs, so students removed from them are dropped.
+    With an empty roster it exits, or with 'sortir_si_buida' off keeps the roster already loaded and returns False."""
+    global DICCIONARI_ALUMNES, INDEX_ALUMNES
     print("📊 Loading student data from CSV files...")
     
     current_script_dir = os.path.dirname(os.path.abspath(__file__))
@@ -45,15 +157,21 @@ def carregar_base_dades_alumnes():
 
     csv_files_to_load = [os.path.join(student_data_full_path, f) for f in os.listdir(student_data_full_path) if f.lower().endswith('.csv')]
     
-    students_list = load_students_from_csv_files(csv_files_to_load) # Call CSV loading function
+    index = load_roster_index(csv_files_to_load) # Parsed CSVs are cached until one of them changes
     
-    if not students_list:
+    if not index["by_id"]:
+        if not sortir_si_buida:
+            print(f"⚠️ No student data loaded from '{student_data_full_path}': keeping the {len(DICCIONARI_ALUMNES)} students already loaded.", file=sys.stderr)
+            return False
         print(f"❌ ERROR: No student data loaded from '{student_data_full_path}'. Cannot proceed with QR reordering.", file=sys.stderr)
         sys.exit(1) # Exit if no student data is found
 
-    for student in students_list:
-        DICCIONARI_ALUMNES[student["id"]] = student["nom"]
+    INDEX_ALUMNES = index
+    for student_id, fitxers in sorted(INDEX_ALUMNES["duplicates"].items()):
+        print(f"⚠️ Duplicate student ID '{student_id}' in: {', '.join(fitxers)} (the last one is used)")
+    DICCIONARI_ALUMNES = {student_id: student["nom"] for student_id, student in INDEX_ALUMNES["by_id"].items()}
     print(f"✅ Loaded data for {len(DICCIONARI_ALUMNES)} students.")
+    return True
 
 # ==============================================================================
 # 2. QR READER MOTORS (Ensure these libraries are installed via pip, e.g., 'pyzbar' and 'qreader')
@@ -61,15 +179,13 @@ def carregar_base_dades_alumnes():
 QREADER_DISPONIBLE = False
 PYZBAR_DISPONIBLE = False
 
-try:
-    from qreader import QReader
-    qreader_instance = QReader(model_size='s')
+# QReader (and torch) are only imported when the first page reaches the neural stage: see obtenir_qreader()
+qreader_instance = None
+if importlib.util.find_spec("qreader") is not None:
     QREADER_DISPONIBLE = True
-    print("✅ QReader Activated")
-except ImportError:
+    print("✅ QReader Available (model loaded on first use)")
+else:
     print("⚠️ QReader not found. Install with `pip install qreader` for better QR detection.")
-except Exception as e:
-    print(f"❌ Error initializing QReader: {e}")
 
 try:
     from pyzbar.pyzbar import decode as pyzbar_decode
@@ -84,23 +200,77 @@ if not QREADER_DISPONIBLE and not PYZBAR_DISPONIBLE:
     print("❌ No QR reader library available. Please install 'qreader' or 'pyzbar'.")
     sys.exit(1)
 
+def obtenir_qreader():
+    """Loads the QReader model the first time it is needed (once per process). Returns None if it cannot be loaded."""
+    global qreader_instance, QREADER_DISPONIBLE
+    if qreader_instance is None and QREADER_DISPONIBLE:
+        try:
+            from qreader import QReader
+            qreader_instance = QReader(model_size='s')
+            print("✅ QReader Activated")
+        except Exception as e:
+            QREADER_DISPONIBLE = False
+            print(f"❌ Error initializing QReader: {e}")
+    return qreader_instance
+
 
 # ==============================================================================
 # 3. IMAGE & ROTATION FUNCTIONS (CORE QR DETECTION LOGIC)
 # ==============================================================================
-def extreure_zona_qr(page):
+class ImatgePixmap(np.ndarray):
+    """NumPy view over a pixmap's sample buffer (no copy). Holds a reference that keeps the pixmap alive."""
+    def __array_finalize__(self, obj):
+        self.pixmap = getattr(obj, "pixmap", None)
+
+def pixmap_a_numpy(pix):
+    """Wraps the pixmap samples as an HxW (gray) or HxWxN array without copying them."""
+    forma = (pix.height, pix.width) if pix.n == 1 else (pix.height, pix.width, pix.n)
+    img = np.frombuffer(pix.samples_mv, dtype=np.uint8).reshape(forma).view(ImatgePixmap)
+    img.pixmap = pix # samples_mv points into the pixmap memory: it must outlive the array
+    return img
+
+def renderitzar_pagina(page, dpi=DPI_DETECCIO, clip=None):
+    """Renders straight to 8-bit grayscale, which is what OpenCV and Pyzbar decode (QReader gets RGB on demand)."""
+    inici = qr_metrics.rellotge()
+    pix = page.get_pixmap(dpi=dpi, clip=clip, colorspace=fitz.csGRAY, alpha=False)
+    qr_metrics.sumar("renderitzat", inici)
+    return pixmap_a_numpy(pix)
+
+# Centres (as page fractions) of the QRs decoded so far in the current PDF
+POSICIONS_QR_OBSERVADES = []
+
+# Last QR read in the current PDF: payload, box (page coordinates) and DPI it was found at
+ULTIM_QR = {"text": None, "rect": None, "dpi": None}
+
+def reiniciar_estat_lot():
+    """Forgets the learned QR position, feed orientation and last QR (each scanner batch can have its own)."""
+    POSICIONS_QR_OBSERVADES.clear()
+    ORIENTACIONS_OBSERVADES.clear()
+    ULTIM_QR.update(text=None, rect=None, dpi=None)
+
+def obtenir_clip_zona(page):
+    """Returns the crop window (page coordinates) where the QR is expected, or None if cropping is disabled."""
+    if not ZONA_QR["activat"]: return None
     rect = page.rect
-    marge = ZONA_QR["marge_seguretat"] if ZONA_QR["activat"] else 0
-    if ZONA_QR["activat"]:
-        x1 = max(0, ZONA_QR["x1"] - marge) * rect.width
-        y1 = max(0, ZONA_QR["y1"] - marge) * rect.height
-        x2 = min(1, ZONA_QR["x2"] + marge) * rect.width
-        y2 = min(1, ZONA_QR["y2"] + marge) * rect.height
-        clip = fitz.Rect(x1, y1, x2, y2)
-        pix = page.get_pixmap(dpi=DPI_DETECCIO, clip=clip)
-    else:
-        pix = page.get_pixmap(dpi=DPI_DETECCIO)
-    return np.array(Image.open(io.BytesIO(pix.tobytes("png"))))
+    x1, y1, x2, y2 = ZONA_QR["x1"], ZONA_QR["y1"], ZONA_QR["x2"], ZONA_QR["y2"]
+    if POSICIONS_QR_OBSERVADES:
+        cx = float(np.median([p[0] for p in POSICIONS_QR_OBSERVADES]))
+        cy = float(np.median([p[1] for p in POSICIONS_QR_OBSERVADES]))
+        mig_w, mig_h = (x2 - x1) / 2, (y2 - y1) / 2
+        x1, y1, x2, y2 = cx - mig_w, cy - mig_h, cx + mig_w, cy + mig_h
+    marge = ZONA_QR["marge_seguretat"]
+    return fitz.Rect(max(0, x1 - marge) * rect.width, max(0, y1 - marge) * rect.height,
+                     min(1, x2 + marge) * rect.width, min(1, y2 + marge) * rect.height)
+
+def aprendre_posicio_qr(page, clip, dpi, punts):
+    """Records where a QR was found (corner points in pixels of an image rendered at 'dpi' from 'clip')."""
+    if not (ZONA_QR["activat"] and ZONA_QR["aprendre"]) or punts is None: return
+    if len(POSICIONS_QR_OBSERVADES) >= ZONA_QR["mostres_aprenentatge"]: return
+    escala = 72 / dpi # pixels -> points
+    origen_x, origen_y = (clip.x0, clip.y0) if clip is not None else (0, 0)
+    cx, cy = np.asarray(punts, dtype=float).reshape(-1, 2).mean(axis=0)
+    rect = page.rect
+    POSICIONS_QR_OBSERVADES.append((float(origen_x + cx * escala) / rect.width, float(origen_y + cy * escala) / rect.height))
 
 def convertir_a_bgr(img_np):
     if len(img_np.shape) == 2: return cv2.cvtColor(img_np, cv2.COLOR_GRAY2BGR)
@@ -108,48 +278,461 @@ def convertir_a_bgr(img_np):
     elif img_np.shape[2] == 3: return cv2.cvtColor(img_np, cv2.COLOR_RGB2BGR)
     return img_np
 
+def convertir_a_gris(img_np):
+    if len(img_np.shape) == 2: return img_np
+    elif img_np.shape[2] == 4: return cv2.cvtColor(img_np, cv2.COLOR_RGBA2GRAY)
+    return cv2.cvtColor(img_np, cv2.COLOR_RGB2GRAY)
+
+ROTACIONS_SENSE_PERDUA = {90: cv2.ROTATE_90_COUNTERCLOCKWISE, 180: cv2.ROTATE_180, 270: cv2.ROTATE_90_CLOCKWISE}
+
 def rotar_imatge_graus(img, angle):
-    """Rotates the image by X degrees, keeping the center."""
-    if angle == 0: return img
+    """Rotates the image by X degrees (counter-clockwise). Multiples of 90º are a lossless transpose/flip;
+    only the remaining skew is warped, keeping the center."""
+    quarts = round(angle / 90)
+    base, resta = (quarts * 90) % 360, angle - quarts * 90
+    if base: img = cv2.rotate(img, ROTACIONS_SENSE_PERDUA[base])
+    if resta == 0: return img
     (h, w) = img.shape[:2]
     center = (w // 2, h // 2)
-    M = cv2.getRotationMatrix2D(center, angle, 1.0)
+    M = cv2.getRotationMatrix2D(center, resta, 1.0)
     return cv2.warpAffine(img, M, (w, h), borderValue=(255, 255, 255))
 
-def llegir_qr_bateria_proves(img_np):
-    img_bgr = convertir_a_bgr(img_np)
-    angles_a_provar = [0, 90, 180, 270, 5, -5, 10, -10] # Angles for robustness
-    preprocessaments = [
-        ("Normal", lambda x: x),
-        ("Contrast", lambda x: cv2.convertScaleAbs(x, alpha=1.5, beta=0)),
-        ("Binari", lambda x: cv2.cvtColor(cv2.adaptiveThreshold(cv2.cvtColor(x, cv2.COLOR_BGR2GRAY), 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 11, 2), cv2.COLOR_GRAY2BGR))
-    ]
-
-    for angle in angles_a_provar:
-        img_rot = rotar_imatge_graus(img_bgr, angle)
-        for nom_proc, func_proc in preprocessaments:
-            try:
-                img_final = func_proc(img_rot)
-
-                # A. OpenCV
-                det = cv2.QRCodeDetector()
-                data, _, _ = det.detectAndDecode(img_final)
-                if data: return data, f"OpenCV/{nom_proc}/{angle}º"
-
-                # B. QReader
-                if QREADER_DISPONIBLE:
-                    res = qreader_instance.detect_and_decode(image=img_final)
-                    if res and res[0]: return res[0], f"QReader/{nom_proc}/{angle}º"
-
-                # C. Pyzbar
-                if PYZBAR_DISPONIBLE and nom_proc in ["Normal", "Binari"]:
-                    gray = cv2.cvtColor(img_final, cv2.COLOR_BGR2GRAY)
-                    res = pyzbar_decode(gray)
-                    if res: return res[0].data.decode("utf-8"), f"Pyzbar/{angle}º"
-            except Exception:
-                continue
+def normalitzar_angle(angle):
+    """Brings an angle to (-180, 180]."""
+    angle = angle % 360
+    return angle - 360 if angle > 180 else angle
+
+# Feed orientations (multiples of 90º) seen on the first pages of the current PDF
+ORIENTACIONS_OBSERVADES = []
+
+def registrar_orientacio(angle):
+    if angle is not None and len(ORIENTACIONS_OBSERVADES) < ORIENTACIO_MOSTRES_LOT:
+        ORIENTACIONS_OBSERVADES.append((round(angle / 90) * 90) % 360)
+
+def orientacio_lot():
+    """The batch feed orientation once the first pages agree on it (majority), else None."""
+    if not ORIENTACIO_PER_LOT or len(ORIENTACIONS_OBSERVADES) < ORIENTACIO_MOSTRES_LOT: return None
+    angle, vots = Counter(ORIENTACIONS_OBSERVADES).most_common(1)[0]
+    return angle if vots * 2 > len(ORIENTACIONS_OBSERVADES) else None
+
+def angle_des_de_punts(punts):
+    """Rotation that makes a QR upright, from its 4 corners as returned by OpenCV (QR order: top-left, top-right, ...)."""
+    if punts is None: return None
+    p = np.asarray(punts, dtype=float).reshape(-1, 2)
+    if len(p) != 4: return None
+    dx, dy = p[1] - p[0]
+    return normalitzar_angle(round(math.degrees(math.atan2(dy, dx))))
+
+def estimar_inclinacio_text(img_gris):
+    """Skew (degrees, within ±45) of the page's text lines, or None if there are not enough lines."""
+    escala = min(1.0, 1000 / max(img_gris.shape))
+    petita = cv2.resize(img_gris, None, fx=escala, fy=escala, interpolation=cv2.INTER_AREA) if escala < 1 else img_gris
+    _, binaria = cv2.threshold(petita, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    linies = cv2.dilate(binaria, cv2.getStructuringElement(cv2.MORPH_RECT, (15, 3))) # Merge letters into line blobs
+    contorns, _ = cv2.findContours(linies, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    angles = []
+    for contorn in contorns:
+        _, (w, h), a = cv2.minAreaRect(contorn)
+        if w < h: w, h, a = h, w, a - 90
+        if w < 40 or w < 4 * h: continue # Only long, thin blobs are text lines
+        angles.append((a + 45) % 90 - 45)
+    return float(np.median(angles)) if angles else None
+
+def estimar_orientacio(img_gris):
+    """Estimates once the rotation (degrees, counter-clockwise) that makes the page upright.
+    The QR finder patterns give the full angle; text lines only give the skew, added to the batch orientation."""
+    try:
+        trobat, punts = DETECTOR_OPENCV.detect(img_gris)
+    except cv2.error:
+        trobat = False
+    if trobat:
+        angle = angle_des_de_punts(punts)
+        if angle is not None:
+            registrar_orientacio(angle)
+            return angle, "QR"
+    inclinacio = estimar_inclinacio_text(img_gris)
+    if inclinacio is None: return None, None
+    return normalitzar_angle(round((orientacio_lot() or 0) + inclinacio)), "Text"
+
+# ==============================================================================
+# 3b. BLANK AND DOUBLE-SCANNED PAGES
+# ==============================================================================
+def es_pagina_blanca(page):
+    """Cheap check of a page the quick tiers could not read: True for a blank page (it skips the battery)."""
+    inici = qr_metrics.rellotge()
+    img = renderitzar_pagina(page, DPI_PREPAS)
+    try:
+        return np.count_nonzero(img < 160) < LLINDAR_TINTA_BLANCA * img.size
+    finally:
+        qr_metrics.sumar("prepas", inici)
+
+def hash_perceptual(img_gris):
+    """64-bit difference hash: is each cell of a 9x8 thumbnail brighter than its left neighbour?"""
+    miniatura = cv2.resize(img_gris, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (miniatura[:, 1:] > miniatura[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+def mateixa_imatge(img_a, img_b):
+    """True if two renders of the same area show the same thing: after undoing the shift between both scans,
+    no 4x4 block differs by more than LLINDAR_DIFERENCIA_DUPLICAT grey levels."""
+    if img_a.shape != img_b.shape: return False
+    (dx, dy), _ = cv2.phaseCorrelate(img_a.astype(np.float32), img_b.astype(np.float32))
+    alineada = cv2.warpAffine(img_b, np.float32([[1, 0, -dx], [0, 1, -dy]]), (img_b.shape[1], img_b.shape[0]), borderValue=255)
+    marge = int(max(abs(dx), abs(dy))) + 4 # The edges uncovered by the shift are not compared
+    diferencia = cv2.blur(cv2.absdiff(img_a, alineada), (4, 4))[marge:-marge, marge:-marge]
+    return diferencia.size > 0 and int(diferencia.max()) <= LLINDAR_DIFERENCIA_DUPLICAT
+
+def empremta_pagina(page):
+    """What unreadable pages are compared on: hash and low-resolution render of the whole page (the answers),
+    and the template's QR window (with its margin) at DPI_DETECCIO, sharp enough to tell two QRs apart."""
+    rect, marge = page.rect, ZONA_QR["marge_seguretat"]
+    zona = fitz.Rect(max(0, ZONA_QR["x1"] - marge) * rect.width, max(0, ZONA_QR["y1"] - marge) * rect.height,
+                     min(1, ZONA_QR["x2"] + marge) * rect.width, min(1, ZONA_QR["y2"] + marge) * rect.height)
+    img = np.array(renderitzar_pagina(page, DPI_PREPAS)) # Copies: the renders' pixmaps are freed otherwise
+    return hash_perceptual(img), img, np.array(renderitzar_pagina(page, DPI_DETECCIO, zona))
+
+def marcar_duplicats(doc, pages_info):
+    """Runs once Phase 1 is done, over the results in 'idx' order (so worker ranges, checkpoints and read-ahead
+    do not matter). A page with the payload of an earlier page, or an unreadable page showing the same sheet as
+    one of the last FINESTRA_DUPLICATS unreadable pages, becomes a duplicate of it (see resoldre_duplicats)."""
+    if not PREPAS_PAGINES: return pages_info
+    lectures, recents = {}, [] # (student, page) -> first idx; (idx, hash, page render, QR window render)
+    for n, p in enumerate(pages_info):
+        if p.get("especial"): continue
+        i, original = p["idx"], None
+        if p["id"] is not None:
+            if p["pag_num"] == 999: continue
+            original = lectures.setdefault((p["id"], p["pag_num"]), i)
+        else:
+            inici = time.perf_counter()
+            hash_pagina, img, zona = empremta_pagina(doc[i])
+            for idx, hash_recent, img_recent, zona_recent in reversed(recents):
+                if i - idx > FINESTRA_DUPLICATS: break
+                if (bin(hash_pagina ^ hash_recent).count("1") <= DISTANCIA_HASH_DUPLICAT
+                        and mateixa_imatge(img_recent, img) and mateixa_imatge(zona_recent, zona)):
+                    original = idx
+                    break
+            if original is None:
+                recents.append((i, hash_pagina, img, zona))
+                del recents[:-FINESTRA_DUPLICATS]
+            if "metriques" in p: qr_metrics.afegir(p["metriques"], "prepas", time.perf_counter() - inici)
+        if original is not None and original != i:
+            pages_info[n] = pagina_especial(i, {"especial": "duplicat", "duplicat_de": original},
+                                            p["nivell"], p["temps_deteccio"], p.get("metriques"))
+    return pages_info
+
+# ==============================================================================
+# 3c. ADAPTIVE DECODER CASCADE (engine x preprocessing x angle, cheapest expected cost first)
+# ==============================================================================
+DETECTOR_OPENCV = cv2.QRCodeDetector() # Reused for every attempt instead of building one per try
+
+PREPROCESSAMENTS = {
+    "Normal": lambda x: x,
+    "Contrast": lambda x: cv2.convertScaleAbs(x, alpha=1.5, beta=0),
+    "Binari": lambda x: cv2.adaptiveThreshold(x, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 11, 2),
+}
+
+# Per-strategy counters ("Motor/Preprocessing/angle" -> attempts, successes, seconds per megapixel), updated live
+ESTADISTIQUES_CASCADA = {}
+
+def llistar_estrategies(angles, etiqueta=None):
+    """(engine, preprocessing, angle, statistics label) for every combination. Estimated angles share the 'auto' label."""
+    estrategies = []
+    for angle in angles:
+        clau_angle = etiqueta or angle
+        for nom_proc in PREPROCESSAMENTS:
+            estrategies.append(("OpenCV", nom_proc, angle, clau_angle))
+            if QREADER_DISPONIBLE: estrategies.append(("QReader", nom_proc, angle, clau_angle))
+            if PYZBAR_DISPONIBLE and nom_proc in ["Normal", "Binari"]: estrategies.append(("Pyzbar", nom_proc, angle, clau_angle))
+    return estrategies
+
+def clau_estrategia(motor, nom_proc, angle):
+    return f"{motor}/{nom_proc}/{angle}"
+
+def cost_esperat_estrategia(motor, nom_proc, angle):
+    """Expected cost per successful decode: mean cost / success rate (both smoothed towards the initial guesses)."""
+    est = ESTADISTIQUES_CASCADA.get(clau_estrategia(motor, nom_proc, angle), {"intents": 0, "exits": 0, "temps": 0.0})
+    exit_inicial = EXIT_INICIAL_ANGLE.get(angle, EXIT_INICIAL_ALTRES)
+    cost = (est["temps"] + 2 * COST_INICIAL_MOTOR[motor]) / (est["intents"] + 2)
+    taxa_exit = (est["exits"] + 2 * exit_inicial) / (est["intents"] + 2)
+    return cost / taxa_exit
+
+def ordenar_estrategies(angles_prioritaris=(), motors=None):
+    """Estimated angles first, then (optionally) the brute-force angles, cheapest expected cost first.
+    The neural model always goes last: it only sees the pages every cheap engine failed on."""
+    estrategies = llistar_estrategies(angles_prioritaris, "auto")
+    if ORIENTACIO_FORCA_BRUTA or not angles_prioritaris:
+        ja_provats = {a % 360 for a in angles_prioritaris}
+        estrategies += llistar_estrategies([a for a in ANGLES_BATERIA if a % 360 not in ja_provats])
+    if motors is not None:
+        estrategies = [e for e in estrategies if e[0] in motors]
+    return sorted(estrategies, key=lambda e: (e[0] == "QReader", e[3] != "auto", cost_esperat_estrategia(e[0], e[1], e[3])))
+
+def registrar_intent(motor, nom_proc, angle, exit, temps):
+    est = ESTADISTIQUES_CASCADA.setdefault(clau_estrategia(motor, nom_proc, angle), {"intents": 0, "exits": 0, "temps": 0.0})
+    est["intents"] += 1
+    est["exits"] += int(exit)
+    est["temps"] += temps
+
+def decodificar_amb_motor(motor, img_gris):
+    qr_metrics.comptar_intent(motor)
+    inici = qr_metrics.rellotge()
+    try:
+        if motor == "OpenCV":
+            data, _, _ = DETECTOR_OPENCV.detectAndDecode(img_gris)
+            return data or None
+        if motor == "Pyzbar":
+            res = pyzbar_decode(img_gris)
+            return res[0].data.decode("utf-8") if res else None
+        res = obtenir_qreader().detect_and_decode(image=cv2.cvtColor(img_gris, cv2.COLOR_GRAY2RGB))
+        return res[0] if res and res[0] else None
+    finally:
+        qr_metrics.sumar("descodificacio", inici)
+
+def nom_metode(motor, nom_proc, angle):
+    if motor == "Pyzbar": return f"Pyzbar/{angle}º"
+    return f"{motor}/{nom_proc}/{angle}º"
+
+def obtenir_angles_prioritaris(img_gris):
+    """Rotate once to the estimated orientation (and the batch feed orientation) instead of trying every angle."""
+    inici = qr_metrics.rellotge()
+    angles_prioritaris = []
+    if ORIENTACIO_AUTOMATICA:
+        angle_estimat, _ = estimar_orientacio(img_gris)
+        if angle_estimat is not None: angles_prioritaris.append(angle_estimat)
+    angle_lot = orientacio_lot()
+    if angle_lot is not None and all((angle_lot - a) % 360 for a in angles_prioritaris):
+        angles_prioritaris.append(angle_lot)
+    qr_metrics.sumar("orientacio", inici)
+    return angles_prioritaris
+
+def llegir_qr_bateria_proves(img_np, amb_neuronal=None):
+    """Full cascade on one image. QReader only takes part when amb_neuronal is set (by default, when
+    QREADER_PER_LOTS is off); otherwise failed pages go to llegir_qr_neuronal_lot afterwards."""
+    img_gris = convertir_a_gris(img_np) # Pages are rendered in grayscale already; this only converts external images
+    imatges = {} # (angle, preprocessing) -> image, built on demand and shared by every engine
+    amb_neuronal = not QREADER_PER_LOTS if amb_neuronal is None else amb_neuronal
+    motors = None if amb_neuronal else ("OpenCV", "Pyzbar")
+
+    megapixels = max(img_gris.size / 1e6, 1e-3) # Costs are normalised: crops and full pages share the statistics
+
+    for motor, nom_proc, angle, clau_angle in ordenar_estrategies(obtenir_angles_prioritaris(img_gris), motors):
+        inici = time.perf_counter()
+        data = None
+        try:
+            if (angle, nom_proc) not in imatges:
+                inici_proc = qr_metrics.rellotge()
+                if (angle, "Normal") not in imatges:
+                    imatges[(angle, "Normal")] = rotar_imatge_graus(img_gris, angle)
+                imatges[(angle, nom_proc)] = PREPROCESSAMENTS[nom_proc](imatges[(angle, "Normal")])
+                qr_metrics.sumar("preprocessament", inici_proc)
+            data = decodificar_amb_motor(motor, imatges[(angle, nom_proc)])
+        except Exception:
+            pass
+        registrar_intent(motor, nom_proc, clau_angle, bool(data), (time.perf_counter() - inici) / megapixels)
+        if data: return data, nom_metode(motor, nom_proc, angle)
     return None, None
 
+# Private qrdet pieces the batched call needs, probed once per process (None = not probed yet, False = missing)
+QRDET_LOT = None
+
+def obtenir_qrdet_lot(model):
+    """Returns (_prepare_input, _yolo_v8_results_to_dict) if the installed qrdet exposes them and its YOLO model,
+    else None. qrdet has no public batch API, so a missing piece (e.g. after an upgrade) is reported once."""
+    global QRDET_LOT
+    if QRDET_LOT is None:
+        try:
+            from qrdet import _prepare_input, _yolo_v8_results_to_dict
+            detector = model.detector
+            detector.model.predict, detector._conf_th, detector._nms_iou
+            QRDET_LOT = (_prepare_input, _yolo_v8_results_to_dict)
+        except (ImportError, AttributeError) as e:
+            QRDET_LOT = False
+            print(f"⚠️ QReader batching unavailable with the installed qrdet ({e}): one model call per image.", file=sys.stderr)
+    return QRDET_LOT or None
+
+def descodificar_qreader_lot(imatges_rgb):
+    """Runs the QReader detector over several images in a single model call and decodes what it finds.
+    Falls back to one call per image if the installed qrdet does not expose its YOLO model."""
+    model = obtenir_qreader()
+    qrdet_lot = obtenir_qrdet_lot(model)
+    if qrdet_lot:
+        preparar_entrada, resultats_a_diccionari = qrdet_lot
+        detector = model.detector
+        entrades = [preparar_entrada(source=img, is_bgr=False) for img in imatges_rgb]
+        resultats = detector.model.predict(source=entrades, conf=detector._conf_th, iou=detector._nms_iou, half=False,
+                                           device=None, max_det=100, augment=False, agnostic_nms=True, classes=None, verbose=False)
+        deteccions = [resultats_a_diccionari(results=r, image=img) for r, img in zip(resultats, entrades)]
+    else:
+        deteccions = [model.detect(image=img) for img in imatges_rgb]
+
+    textos = []
+    for img, deteccions_img in zip(imatges_rgb, deteccions):
+        textos.append(next((t for t in (model.decode(image=img, detection_result=d) for d in deteccions_img) if t), None))
+    return textos
+
+def llegir_qr_neuronal_lot(imatges, registres_metriques=None):
+    """Neural stage for the pages the cheap engines could not read. Round after round, every unresolved
+    image contributes its next QReader strategy (same order as in the battery) to one batched model call.
+    Returns one (qr_text, method) pair per image. Attempts are counted in 'registres_metriques' (one per image)."""
+    if not imatges or obtenir_qreader() is None: return [(None, None)] * len(imatges)
+    imatges = [convertir_a_gris(img) for img in imatges]
+    plans = [ordenar_estrategies(obtenir_angles_prioritaris(img), ("QReader",)) for img in imatges]
+    resultats = [(None, None)] * len(imatges)
+    pendents = list(range(len(imatges)))
+
+    for ronda in range(max(len(pla) for pla in plans)):
+        actius = [k for k in pendents if ronda < len(plans[k])]
+        if not actius: break
+        entrades = []
+        inici_proc = qr_metrics.rellotge()
+        for k in actius:
+            _, nom_proc, angle, _ = plans[k][ronda]
+            entrades.append(cv2.cvtColor(PREPROCESSAMENTS[nom_proc](rotar_imatge_graus(imatges[k], angle)), cv2.COLOR_GRAY2RGB))
+        qr_metrics.sumar("preprocessament", inici_proc)
+
+        inici, inici_metriques = time.perf_counter(), qr_metrics.rellotge()
+        try:
+            textos = descodificar_qreader_lot(entrades)
+        except Exception as e: # A failing model call costs this round, not the run; it is still reported
+            print(f"❌ QReader failed on a batch of {len(entrades)} images: {e}", file=sys.stderr)
+            textos = [None] * len(entrades)
+        temps = (time.perf_counter() - inici) / len(actius)
+        qr_metrics.sumar("descodificacio", inici_metriques)
+
+        for k, text in zip(actius, textos):
+            motor, nom_proc, angle, clau_angle = plans[k][ronda]
+            if registres_metriques: qr_metrics.comptar_intent(motor, registres_metriques[k])
+            registrar_intent(motor, nom_proc, clau_angle, bool(text), temps / max(imatges[k].size / 1e6, 1e-3))
+            if text:
+                resultats[k] = (text, nom_metode(motor, nom_proc, angle))
+                pendents.remove(k)
+    return resultats
+
+def carregar_estadistiques_cascada(ruta=None):
+    """Loads the strategy statistics of previous runs (if the file exists)."""
+    ruta = ruta or FITXER_ESTADISTIQUES_CASCADA
+    if not ruta or not os.path.exists(ruta): return
+    try:
+        with open(ruta, "r", encoding="utf-8") as f:
+            ESTADISTIQUES_CASCADA.update(json.load(f))
+        print(f"📈 Loaded decoder statistics for {len(ESTADISTIQUES_CASCADA)} strategies.")
+    except Exception as e:
+        print(f"⚠️ Could not read decoder statistics '{ruta}': {e}")
+
+def guardar_estadistiques_cascada(ruta=None):
+    ruta = ruta or FITXER_ESTADISTIQUES_CASCADA
+    if not ruta or not ESTADISTIQUES_CASCADA: return
+    with open(ruta + ".part", "w", encoding="utf-8") as f:
+        json.dump(ESTADISTIQUES_CASCADA, f, indent=4, sort_keys=True)
+    os.replace(ruta + ".part", ruta)
+
+def copiar_estadistiques_cascada():
+    return {clau: dict(est) for clau, est in ESTADISTIQUES_CASCADA.items()}
+
+def diferencia_estadistiques_cascada(abans):
+    """Counters added since the snapshot 'abans' (what a worker sends back to the main process)."""
+    delta = {}
+    for clau, est in ESTADISTIQUES_CASCADA.items():
+        prev = abans.get(clau, {"intents": 0, "exits": 0, "temps": 0.0})
+        if est["intents"] > prev["intents"]:
+            delta[clau] = {k: est[k] - prev[k] for k in ("intents", "exits", "temps")}
+    return delta
+
+def fusionar_estadistiques_cascada(delta):
+    for clau, d in delta.items():
+        est = ESTADISTIQUES_CASCADA.setdefault(clau, {"intents": 0, "exits": 0, "temps": 0.0})
+        for k in ("intents", "exits", "temps"):
+            est[k] += d[k]
+
+def llegir_qr_rapid(img_np):
+    """Single cheap attempt (no rotation, no preprocessing, no neural model). Same method strings as the battery.
+    Also returns the QR corner points in image pixels (or None), used to learn the QR position."""
+    img_gris = convertir_a_gris(img_np)
+    inici = qr_metrics.rellotge()
+    try:
+        qr_metrics.comptar_intent("OpenCV")
+        data, punts, _ = DETECTOR_OPENCV.detectAndDecode(img_gris)
+        if data: return data, "OpenCV/Normal/0º", punts
+        if PYZBAR_DISPONIBLE:
+            qr_metrics.comptar_intent("Pyzbar")
+            res = pyzbar_decode(img_gris)
+            if res:
+                r = res[0].rect
+                punts = [(r.left, r.top), (r.left + r.width, r.top + r.height)]
+                return res[0].data.decode("utf-8"), "Pyzbar/0º", punts
+    except Exception:
+        pass
+    finally:
+        qr_metrics.sumar("descodificacio", inici)
+    return None, None, None
+
+def rect_des_de_punts(clip, dpi, punts):
+    """QR corner points (pixels of an image rendered at 'dpi' from 'clip') -> bounding box in page coordinates."""
+    escala = 72 / dpi
+    origen_x, origen_y = (clip.x0, clip.y0) if clip is not None else (0, 0)
+    punts = np.asarray(punts, dtype=float).reshape(-1, 2)
+    (x0, y0), (x1, y1) = punts.min(axis=0), punts.max(axis=0)
+    return fitz.Rect(origen_x + x0 * escala, origen_y + y0 * escala, origen_x + x1 * escala, origen_y + y1 * escala)
+
+def recordar_qr(clip, dpi, punts):
+    """Keeps where the last QR was found, for the predictive check of the next page."""
+    if punts is None: return
+    ULTIM_QR.update(rect=rect_des_de_punts(clip, dpi, punts), dpi=dpi)
+
+def predir_seguent_qr():
+    """Expected payload of the next page (same student, next page number), or None."""
+    dades = parsejar_qr(ULTIM_QR["text"])
+    if not dades or dades["pag"] == 999: return None
+    return f"{dades['id']}-{dades['pag'] + 1}"
+
+def verificar_prediccio(page):
+    """Cheap targeted decode: one quick attempt on a tight crop around the last QR, at the DPI it was read at.
+    Returns (qr_text, method, tier, image) or None if the check fails."""
+    rect, dpi = ULTIM_QR["rect"], ULTIM_QR["dpi"]
+    if not MODE_PREDICTIU or rect is None: return None
+    marge = MARGE_VERIFICACIO * max(rect.width, rect.height)
+    clip = fitz.Rect(rect.x0 - marge, rect.y0 - marge, rect.x1 + marge, rect.y1 + marge) & page.rect
+    if clip.is_empty: return None
+
+    img_np = renderitzar_pagina(page, dpi, clip)
+    qr, met, punts = llegir_qr_rapid(img_np)
+    if not parsejar_qr(qr): return None
+    recordar_qr(clip, dpi, punts)
+    # A different (valid) payload is still a correct read: usually the first page of the next student
+    nivell = "Predicció" if qr.strip() == predir_seguent_qr() else "Verificació"
+    return qr, met, f"{nivell}/{dpi}dpi", img_np
+
+def detectar_qr_pagina(page, abans_bateria=None):
+    """Coarse-to-fine detection, first on the QR crop window and then on the whole page.
+    In predictive mode a quick check at the last QR position comes first.
+    'abans_bateria' is called once, before the first full battery (the first expensive step): if it returns
+    True, detection stops there. Returns (qr_text, method, tier, image of the last tier tried)."""
+    verificat = verificar_prediccio(page)
+    if verificat: return verificat
+
+    clip_zona = obtenir_clip_zona(page)
+    zones = [("Zona", clip_zona), ("Pàgina", None)] if clip_zona is not None else [("Pàgina", None)]
+
+    for nom_zona, clip in zones:
+        for dpi in NIVELLS_DPI:
+            img_np = renderitzar_pagina(page, dpi, clip)
+            qr, met, punts = llegir_qr_rapid(img_np)
+            if qr:
+                aprendre_posicio_qr(page, clip, dpi, punts)
+                registrar_orientacio(angle_des_de_punts(punts))
+                recordar_qr(clip, dpi, punts)
+                return qr, met, f"{nom_zona}/{dpi}dpi", img_np
+
+        if abans_bateria is not None:
+            if abans_bateria(): return None, None, f"Prepàs/{DPI_PREPAS}dpi", None
+            abans_bateria = None
+        img_np = renderitzar_pagina(page, DPI_DETECCIO, clip)
+        qr, met = llegir_qr_bateria_proves(img_np)
+        if qr: return qr, met, f"{nom_zona}/{DPI_DETECCIO}dpi+Bateria", img_np
+
+    return None, None, f"{nom_zona}/{DPI_DETECCIO}dpi+Bateria", img_np
+
 def parsejar_qr(qr_text):
     if not qr_text: return None
     if "-" in qr_text:
@@ -166,15 +749,281 @@ def obtenir_index_grup(num_pagina):
     return 999 # Default for pages not in any group
 
 def guardar_debug(img_np, nom_pdf, i):
+    if img_np is None: return # Result came from the decode cache: nothing was rendered
     os.makedirs(CARPETA_DEBUG, exist_ok=True) # Ensure debug folder exists
     cv2.imwrite(f"{CARPETA_DEBUG}/FAIL_{os.path.splitext(nom_pdf)[0]}_pag{i}.jpg", convertir_a_bgr(img_np))
 
+def parametres_deteccio():
+    """Every setting that can change what a page decodes to (part of the decode cache key)."""
+    return {
+        "dpi": DPI_DETECCIO, "nivells": NIVELLS_DPI, "zona": ZONA_QR, "angles": ANGLES_BATERIA,
+        "orientacio": (ORIENTACIO_AUTOMATICA, ORIENTACIO_FORCA_BRUTA), "preprocessaments": list(PREPROCESSAMENTS),
+        "motors": (QREADER_DISPONIBLE, PYZBAR_DISPONIBLE), "predictiu": MODE_PREDICTIU,
+    }
+
+def llegir_pagina(page, i, nom_base):
+    """Decodes the QR of one page and returns its (small, picklable) result dict.
+    Pages left for the batched neural stage are marked 'pendent_neuronal' (see resoldre_pendents_neuronals).
+    Blank pages are marked 'especial' and not decoded (see es_pagina_blanca); double scans are found
+    once every page is decoded (see marcar_duplicats)."""
+    inici = time.perf_counter()
+    if METRIQUES: qr_metrics.iniciar_pagina()
+    clau_cache, encert = None, None
+    if FITXER_CACHE_DECODIFICACIO:
+        inici_cache = qr_metrics.rellotge()
+        clau_cache = qr_cache.clau_pagina(page, qr_cache.hash_parametres(parametres_deteccio()))
+        encert = qr_cache.llegir(FITXER_CACHE_DECODIFICACIO, clau_cache)
+        qr_metrics.sumar("cache", inici_cache)
+
+    prepas = {} # Only pages the cheap tiers cannot read are checked for being blank
+    def apartar():
+        if es_pagina_blanca(page): prepas["especial"] = "blanca"
+        return bool(prepas)
+
+    if encert:
+        (qr, met, _), nivell, img_np = encert, "Cache", None
+        if PREPAS_PAGINES and not qr: apartar()
+    else:
+        qr, met, nivell, img_np = detectar_qr_pagina(page, apartar if PREPAS_PAGINES else None)
+    if parsejar_qr(qr): ULTIM_QR["text"] = qr
+    registre_metriques = qr_metrics.tancar_pagina()
+    if prepas: return pagina_especial(i, prepas, f"Prepàs/{DPI_PREPAS}dpi", time.perf_counter() - inici, registre_metriques)
+
+    info = {
+        "idx": i, # Original index in the scanned PDF
+        "id": None, "pag_num": 9999, "nom": "ZZ_NoQR", "metode": "❌ Error",
+        "sort": (999, "ZZ_NoQR", 9999), # Tuple for sorting: (group_index, student_name, page_number)
+        "nivell": nivell, "temps_deteccio": time.perf_counter() - inici # Detection tier reached and its cost
+    }
+    if registre_metriques is not None: info["metriques"] = registre_metriques
+
+    if not encert and not qr and QREADER_PER_LOTS and QREADER_DISPONIBLE:
+        info.update({"pendent_neuronal": True, "clau_cache": clau_cache})
+        return info
+
+    if clau_cache and not encert: qr_cache.guardar(FITXER_CACHE_DECODIFICACIO, clau_cache, qr, met, nivell)
+    aplicar_resultat_qr(info, qr, met, img_np, nom_base)
+    return info
+
+def pagina_especial(i, prepas, nivell, temps, registre_metriques):
+    """Result dict of a page set apart. Blank pages get their own bucket after the pages without QR;
+    duplicates get their original's student once it is known (see resoldre_duplicats)."""
+    info = {"idx": i, "id": None, "pag_num": 9999, "nivell": nivell, "temps_deteccio": temps, **prepas}
+    if prepas["especial"] == "blanca":
+        print(f"⬜ Page {i+1:2d} -> Blank page.")
+        info.update({"nom": "ZZ_Blanca", "metode": "⬜ Blanca", "sort": (1000, "ZZ_Blanca", i)})
+    else:
+        print(f"♊ Page {i+1:2d} -> Double scan of page {prepas['duplicat_de']+1}.")
+        info.update({"nom": "ZZ_NoQR", "metode": f"♊ Duplicat(p.{prepas['duplicat_de']+1})", "sort": (999, "ZZ_NoQR", 9999)})
+    if registre_metriques is not None: info["metriques"] = registre_metriques
+    return info
+
+def aplicar_resultat_qr(info, qr, met, img_np, nom_base):
+    i = info["idx"]
+    if qr:
+        dades = parsejar_qr(qr)
+        if dades:
+            nom_alumne = DICCIONARI_ALUMNES.get(dades["id"], f"⚠️ Desconegut ({dades['id']})")
+            print(f"✅ Page {i+1:2d} -> {nom_alumne:<25} (P.{dades['pag']}) [{met}]")
+            info.update({
+                "id": dades["id"], "pag_num": dades["pag"], "nom": nom_alumne, "metode": met,
+                "sort": (obtenir_index_grup(dades["pag"]), nom_alumne, dades["pag"])
+            })
+            if "metriques" in info: info["metriques"]["estrategia"] = met
+        else:
+            print(f"❌ Page {i+1:2d} -> Unreadable QR: {qr}")
+            guardar_debug(img_np, nom_base, i+1)
+    else:
+        print(f"❌ Page {i+1:2d} -> No QR found.")
+        guardar_debug(img_np, nom_base, i+1)
+
+def resoldre_pendents_neuronals(doc, infos, nom_base):
+    """Batched neural stage for the pages of 'infos' that every cheap engine failed on.
+    The model is only loaded (lazily) if at least one such page exists."""
+    pendents = [info for info in infos if info.pop("pendent_neuronal", False)]
+    for inici in range(0, len(pendents), MIDA_LOT_QREADER):
+        lot = pendents[inici:inici + MIDA_LOT_QREADER]
+        registres = [info["metriques"] for info in lot if "metriques" in info]
+        if registres: qr_metrics.iniciar_pagina() # One record for the whole batch, shared out afterwards
+        t0 = time.perf_counter()
+        imatges = [renderitzar_pagina(doc[info["idx"]], DPI_DETECCIO) for info in lot]
+        resultats = llegir_qr_neuronal_lot(imatges, registres if len(registres) == len(lot) else None)
+        temps = (time.perf_counter() - t0) / len(lot)
+        registre_lot = qr_metrics.tancar_pagina()
+        if registres: qr_metrics.repartir_lot(registre_lot, registres)
+
+        for info, img_np, (qr, met) in zip(lot, imatges, resultats):
+            info["nivell"] = f"Pàgina/{DPI_DETECCIO}dpi+QReader"
+            info["temps_deteccio"] += temps
+            clau_cache = info.pop("clau_cache", None)
+            if clau_cache: qr_cache.guardar(FITXER_CACHE_DECODIFICACIO, clau_cache, qr, met, info["nivell"])
+            aplicar_resultat_qr(info, qr, met, img_np, nom_base)
+    return infos
+
+def inicialitzar_worker(diccionari_alumnes, estadistiques_cascada=None, index_alumnes=None):
+    """Runs once when a worker process starts. QReader is loaded lazily, at most once per worker."""
+    global DICCIONARI_ALUMNES, INDEX_ALUMNES
+    DICCIONARI_ALUMNES = diccionari_alumnes
+    INDEX_ALUMNES = index_alumnes
+    ESTADISTIQUES_CASCADA.update(estadistiques_cascada or {})
+
+def llegir_rang_pagines(ruta_in, inici, fi):
+    """Worker task: opens the PDF on its own and decodes pages [inici, fi).
+    Returns the page results and the decoder statistics gathered while doing it."""
+    nom_base = os.path.basename(ruta_in)
+    reiniciar_estat_lot() # Each worker learns the QR position and orientation on its own
+    abans = copiar_estadistiques_cascada()
+    doc = fitz.open(ruta_in)
+    try:
+        infos = resoldre_pendents_neuronals(doc, [llegir_pagina(doc[i], i, nom_base) for i in range(inici, fi)], nom_base)
+    finally:
+        doc.close()
+    return infos, diferencia_estadistiques_cascada(abans)
+
+def llegir_qr_pagines(doc, ruta_in, workers=None):
+    """PHASE 1: decodes every page, sequentially or in a process pool. Always returns results in 'idx' order."""
+    workers = WORKERS_DETECCIO if workers is None else workers
+    workers = workers or os.cpu_count() or 1
+    n_pagines = doc.page_count
+    nom_base = os.path.basename(ruta_in)
+
+    if workers <= 1 or n_pagines <= PAGINES_PER_TASCA:
+        reiniciar_estat_lot()
+        if not MODE_STREAMING:
+            return resoldre_pendents_neuronals(doc, [llegir_pagina(page, i, nom_base) for i, page in enumerate(doc)], nom_base)
+        # Reopening the PDF per window keeps MuPDF's page and image caches to one window
+        pages_info = []
+        for inici in range(0, n_pagines, MIDA_FINESTRA):
+            with fitz.open(ruta_in) as doc_finestra:
+                finestra = [llegir_pagina(doc_finestra[i], i, nom_base) for i in range(inici, min(inici + MIDA_FINESTRA, n_pagines))]
+                pages_info.extend(resoldre_pendents_neuronals(doc_finestra, finestra, nom_base))
+            fitz.TOOLS.store_shrink(100) # Drop the decoded images MuPDF keeps cached between windows
+        return pages_info
+
+    # Split the document into contiguous page ranges; small enough to balance the load between workers
+    mida_tasca = max(1, min(PAGINES_PER_TASCA, math.ceil(n_pagines / workers)))
+    rangs = [(inici, min(inici + mida_tasca, n_pagines)) for inici in range(0, n_pagines, mida_tasca)]
+    workers = min(workers, len(rangs))
+    print(f"⚙️ Decoding {n_pagines} pages with {workers} workers ({len(rangs)} tasks)...")
+
+    # 'spawn' gives each worker a clean interpreter (forking a process that holds a loaded torch model is unsafe)
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                             initializer=inicialitzar_worker, initargs=(DICCIONARI_ALUMNES, copiar_estadistiques_cascada())) as executor:
+        pages_info = []
+        for infos, delta in executor.map(llegir_rang_pagines, [ruta_in] * len(rangs), *zip(*rangs)):
+            pages_info.extend(infos)
+            fusionar_estadistiques_cascada(delta)
+
+    pages_info.sort(key=lambda x: x['idx'])
+    return pages_info
+
+def carregar_punt_control(ruta):
+    """Page results saved by an earlier (interrupted) run: {idx: (page key, info)}.
+    A line cut short by a crash is ignored; when a page appears twice, the last line wins."""
+    desats = {}
+    if not os.path.exists(ruta): return desats
+    with open(ruta, "r", encoding="utf-8") as f:
+        for linia in f:
+            try:
+                registre = json.loads(linia)
+            except json.JSONDecodeError:
+                continue
+            info = registre["info"]
+            info["sort"] = tuple(info["sort"]) # JSON turns the sort tuple into a list
+            desats[info["idx"]] = (registre["clau"], info)
+    return desats
+
+def llegir_qr_pagines_incremental(doc, ruta_in, ruta_punt_control, fins_a=None):
+    """Sequential PHASE 1 that appends each page result to a JSON-lines checkpoint as soon as it is known.
+    Pages whose content still matches their checkpoint line are not decoded again, so a run that stopped halfway
+    resumes where it was. 'fins_a' only decodes the first pages (PDFs that are still being written)."""
+    nom_base = os.path.basename(ruta_in)
+    hash_params = qr_cache.hash_parametres(parametres_deteccio())
+    desats = carregar_punt_control(ruta_punt_control)
+    n_pagines = doc.page_count if fins_a is None else min(fins_a, doc.page_count)
+    reiniciar_estat_lot()
+
+    pages_info, pendents, claus, reaprofitades = [], [], {}, 0
+    carpeta = os.path.dirname(ruta_punt_control)
+    if carpeta: os.makedirs(carpeta, exist_ok=True)
+    with open(ruta_punt_control, "a", encoding="utf-8") as f:
+        def desar(infos):
+            for info in infos:
+                f.write(json.dumps({"clau": claus[info["idx"]], "info": info}, ensure_ascii=False) + "\n")
+            f.flush()
+
+        for i in range(n_pagines):
+            page = doc[i]
+            clau = qr_cache.clau_pagina(page, hash_params) # The page must be the same one that was checkpointed
+            if i in desats and desats[i][0] == clau:
+                info = desats[i][1]
+                if info["id"] is not None: # The roster may have changed since
+                    info["nom"] = DICCIONARI_ALUMNES.get(info["id"], f"⚠️ Desconegut ({info['id']})")
+                    info["sort"] = (obtenir_index_grup(info["pag_num"]), info["nom"], info["pag_num"])
+                pages_info.append(info)
+                reaprofitades += 1
+                continue
+
+            info = llegir_pagina(page, i, nom_base)
+            claus[i] = clau
+            pages_info.append(info)
+            if not info.get("pendent_neuronal"):
+                desar([info])
+                continue
+            pendents.append(info)
+            if len(pendents) >= MIDA_LOT_QREADER:
+                desar(resoldre_pendents_neuronals(doc, pendents, nom_base))
+                pendents = []
+        if pendents: desar(resoldre_pendents_neuronals(doc, pendents, nom_base))
+
+    if reaprofitades: print(f"♻️ Resumed {reaprofitades} of {n_pagines} pages from the checkpoint.")
+    return pages_info
+
+def resum_nivells_deteccio(pages_info):
+    """Prints how many pages each detection tier resolved and what they cost."""
+    per_nivell = defaultdict(list)
+    for p in pages_info:
+        if p.get("especial"):
+            clau = f"{p['nivell']} ({p['especial']})"
+        else:
+            clau = p["nivell"] if p["id"] is not None else f"{p['nivell']} (failed)"
+        per_nivell[clau].append(p["temps_deteccio"])
+    print("🎯 Detection tiers:")
+    for nivell, temps in sorted(per_nivell.items()):
+        print(f"   {nivell:<28} {len(temps):4d} pages, {1000 * sum(temps) / len(temps):7.1f} ms/page")
+
 # ==============================================================================
 # 4. ADVANCED LOGIC (INTERPOLATION AND EXTRAPOLATION)
 # ==============================================================================
+def resoldre_ids_desconeguts(pages_info):
+    """Decoded IDs that are not on the roster. QR payloads are error-corrected, so such an ID usually belongs to a
+    student whose class CSV is not loaded rather than to a misread: the nearest roster ID (csv_utils.nearest_student_id)
+    only replaces it when the previous or next page of the batch carries that ID with the adjacent page number.
+    Otherwise the decoded ID is kept and the candidate is stored as 'id_suggerit' (JSON map and audit)."""
+    if INDEX_ALUMNES is None: return pages_info
+    ordenades = sorted((p for p in pages_info if not p.get('especial')), key=lambda x: x['idx'])
+    for n, p in enumerate(ordenades):
+        if p['id'] is None or p['id'] in DICCIONARI_ALUMNES: continue
+        id_proper = nearest_student_id(INDEX_ALUMNES, p['id'])
+        if id_proper is None: continue
+        veins = [(ordenades[m], pas) for m, pas in ((n - 1, -1), (n + 1, 1)) if 0 <= m < len(ordenades)]
+        if not any(v['id'] == id_proper and v['pag_num'] == p['pag_num'] + pas for v, pas in veins):
+            print(f"❓ Page {p['idx']+1}: unknown ID '{p['id']}' kept (closest roster ID '{id_proper}' is not on the neighbouring pages)")
+            p['id_suggerit'] = id_proper
+            continue
+        print(f"🔧 Page {p['idx']+1}: unknown ID '{p['id']}' resolved to '{id_proper}' (neighbouring page)")
+        p['id_llegit'] = p['id']
+        p['id'] = id_proper
+        p['nom'] = DICCIONARI_ALUMNES[id_proper]
+        p['metode'] += "+≈ID"
+        p['sort'] = (obtenir_index_grup(p['pag_num']), p['nom'], p['pag_num'])
+    return pages_info
+
 def arreglar_forats_logicament(pages_info):
     print("🧠 Applying Logical Intelligence for missing QRs...")
     pages_info.sort(key=lambda x: x['idx']) # Sort by original PDF order
+    totes, pages_info = pages_info, [p for p in pages_info if not p.get('especial')] # Blank sides and double scans are not exam pages
     canvis = 0
 
     # 1. INTERPOLATION (filling gaps in the middle)
@@ -185,9 +1034,8 @@ def arreglar_forats_logicament(pages_info):
             next_p = pages_info[i+1]
             if (prev['id'] and next_p['id'] and prev['id'] == next_p['id']):
                 diff_pag = next_p['pag_num'] - prev['pag_num']
-                diff_idx = next_p['idx'] - prev['idx']
-                if diff_pag == diff_idx and diff_idx > 0: # Ensure valid logical sequence and avoid division by zero
-                    pag_esperada = prev['pag_num'] + (actual['idx'] - prev['idx'])
+                if diff_pag == 2: # Ensure valid logical sequence (neighbours in batch order, set-apart pages skipped)
+                    pag_esperada = prev['pag_num'] + 1
                     actual['id'] = prev['id']
                     actual['pag_num'] = pag_esperada
                     actual['nom'] = DICCIONARI_ALUMNES.get(prev['id'], f"⚠️ Desconegut ({prev['id']})")
@@ -232,6 +1080,17 @@ def arreglar_forats_logicament(pages_info):
                 canvis += 1
     
     if canvis == 0: print(" (No deduction needed)")
+    return totes
+
+def resoldre_duplicats(pages_info):
+    """Double-scanned pages take the final student and page of their original (read or deduced),
+    so they land right after it in the output."""
+    per_idx = {p['idx']: p for p in pages_info}
+    for p in pages_info:
+        if p.get('especial') != "duplicat": continue
+        original = per_idx.get(p['duplicat_de'])
+        if original is None: continue
+        p.update({k: original[k] for k in ('id', 'pag_num', 'nom', 'sort')})
     return pages_info
 
 def auditoria_final(pages_info):
@@ -250,102 +1109,212 @@ def auditoria_final(pages_info):
         if faltes:
             print(f"⚠️ {alumne}: Missing pages {sorted(list(faltes))}")
             alguna_alerta = True
+    for p in sorted((p for p in pages_info if p.get('especial') == "duplicat"), key=lambda x: x['idx']):
+        print(f"♊ Page {p['idx']+1} is a double scan of page {p['duplicat_de']+1} ({p['nom']}, P.{p['pag_num']})")
+        alguna_alerta = True
+    for p in sorted((p for p in pages_info if "id_llegit" in p or "id_suggerit" in p), key=lambda x: x['idx']):
+        if "id_llegit" in p:
+            print(f"🔧 Page {p['idx']+1}: QR ID '{p['id_llegit']}' is not on the roster, filed as '{p['id']}' (neighbouring page)")
+        else:
+            print(f"❓ Page {p['idx']+1}: QR ID '{p['id']}' is not on the roster (closest: '{p['id_suggerit']}'). Is its class CSV loaded?")
+        alguna_alerta = True
+    blanques = sum(1 for p in pages_info if p.get('especial') == "blanca")
+    if blanques: print(f"⬜ {blanques} blank pages set apart at the end of the PDF.")
     if not alguna_alerta: print("✅ All good.")
     print("--------------------")
 
+def afegir_pagina_sortida(nou_doc, doc, original_page_index):
+    """Appends one source page to the output document, copied as is or re-rendered (MODE_SORTIDA)."""
+    if MODE_SORTIDA == "raster":
+        pix = doc[original_page_index].get_pixmap(dpi=DPI_SORTIDA)
+        nova = nou_doc.new_page(width=pix.width, height=pix.height)
+        nova.insert_image(nova.rect, stream=pix.tobytes("jpg", jpg_quality=QUALITAT_JPG))
+    else:
+        nou_doc.insert_pdf(doc, from_page=original_page_index, to_page=original_page_index)
+
+def escriure_pdf_reordenat(doc, ordre, ruta_tmp):
+    """Writes the pages of 'doc' in the order 'ordre' (original indices) to 'ruta_tmp'.
+    The caller renames it into place, so the final name only appears once the file is complete."""
+    if MODE_SORTIDA == "raster":
+        nou_doc = fitz.open() # New PDF document for reordered pages
+        for original_page_index in ordre:
+            afegir_pagina_sortida(nou_doc, doc, original_page_index)
+        nou_doc.save(ruta_tmp)
+        nou_doc.close()
+    else:
+        # Only the page tree is rewritten: the scanner's image streams are copied untouched
+        doc.select(ordre)
+        doc.save(ruta_tmp, garbage=1)
+
+def escriure_pdf_per_finestres(ruta_in, ordre, ruta_tmp):
+    """Streaming version of escriure_pdf_reordenat: MIDA_FINESTRA pages at a time, appended to 'ruta_tmp'
+    with incremental saves. Neither the source nor the output document is ever fully held in memory."""
+    for inici in range(0, len(ordre), MIDA_FINESTRA):
+        with fitz.open(ruta_in) as doc:
+            nou_doc = fitz.open(ruta_tmp) if inici else fitz.open()
+            for original_page_index in ordre[inici:inici + MIDA_FINESTRA]:
+                afegir_pagina_sortida(nou_doc, doc, original_page_index)
+            if inici:
+                nou_doc.saveIncr()
+            else:
+                nou_doc.save(ruta_tmp) # A PDF needs at least one page, so the file is created with the first window
+            nou_doc.close()
+        fitz.TOOLS.store_shrink(100)
+
 # ==============================================================================
 # 5. MAIN PROCESSING LOOP FOR PDF REORDERING
 # ==============================================================================
-def processar_un_pdf(ruta_in, ruta_out, DICCIONARI_ALUMNES_LOCAL):
+def processar_un_pdf(ruta_in, ruta_out, DICCIONARI_ALUMNES_LOCAL, workers=None, ruta_punt_control=None):
+    """Reorders one scanned PDF. With 'ruta_punt_control', pages are decoded sequentially and checkpointed
+    (see llegir_qr_pagines_incremental), so an interrupted call can be repeated without starting over.
+    Returns a summary dict ({"fitxer", "ok", "pagines", "fallades"}, plus "metriques" with METRIQUES), not a boolean:
+    the dict is truthy even when the file failed, so callers must test resum["ok"]."""
     # Make DICCIONARI_ALUMNES accessible within this function
     global DICCIONARI_ALUMNES
     DICCIONARI_ALUMNES = DICCIONARI_ALUMNES_LOCAL 
     
+    nom_base = os.path.basename(ruta_in)
+    resum = {"fitxer": nom_base, "ok": False, "pagines": 0, "fallades": 0}
+
     try:
         doc = fitz.open(ruta_in)
     except Exception as e:
         print(f"❌ ERROR: Could not open PDF file '{ruta_in}': {e}", file=sys.stderr)
-        return False
+        return resum
 
-    nom_base = os.path.basename(ruta_in)
     print(f"📂 Processing: '{nom_base}'...")
 
-    pages_info = []
+    etapes = {} # Seconds per file stage (reported with METRIQUES)
+    inici = time.perf_counter()
 
     # PHASE 1: QR Reading
-    for i, page in enumerate(doc):
-        img_np = extreure_zona_qr(page)
-        qr, met = llegir_qr_bateria_proves(img_np)
-
-        info = {
-            "idx": i, # Original index in the scanned PDF
-            "id": None, "pag_num": 9999, "nom": "ZZ_NoQR", "metode": "❌ Error",
-            "sort": (999, "ZZ_NoQR", 9999) # Tuple for sorting: (group_index, student_name, page_number)
-        }
-
-        if qr:
-            dades = parsejar_qr(qr)
-            if dades:
-                nom_alumne = DICCIONARI_ALUMNES.get(dades["id"], f"⚠️ Desconegut ({dades['id']})")
-                print(f"✅ Page {i+1:2d} -> {nom_alumne:<25} (P.{dades['pag']}) [{met}]")
-                info.update({
-                    "id": dades["id"], "pag_num": dades["pag"], "nom": nom_alumne, "metode": met,
-                    "sort": (obtenir_index_grup(dades["pag"]), nom_alumne, dades["pag"])
-                })
-            else:
-                print(f"❌ Page {i+1:2d} -> Unreadable QR: {qr}")
-                guardar_debug(img_np, nom_base, i+1)
-        else:
-            print(f"❌ Page {i+1:2d} -> No QR found.")
-            guardar_debug(img_np, nom_base, i+1)
-            
-        pages_info.append(info)
+    if ruta_punt_control:
+        pages_info = llegir_qr_pagines_incremental(doc, ruta_in, ruta_punt_control)
+    else:
+        pages_info = llegir_qr_pagines(doc, ruta_in, workers)
+    pages_info = marcar_duplicats(doc, pages_info)
+    resum_nivells_deteccio(pages_info)
+    if FITXER_CACHE_DECODIFICACIO: qr_cache.expulsar(FITXER_CACHE_DECODIFICACIO)
+    etapes["lectura_qr"], inici = time.perf_counter() - inici, time.perf_counter()
 
     # PHASE 2: Intelligent Deduction
+    pages_info = resoldre_ids_desconeguts(pages_info)
     pages_info = arreglar_forats_logicament(pages_info)
+    pages_info = resoldre_duplicats(pages_info)
+    etapes["deduccio"], inici = time.perf_counter() - inici, time.perf_counter()
 
     # PHASE 3: Reorder and prepare metadata
     print("🔄 Generating reordered PDF and saving MAP data...")
     pages_info.sort(key=lambda x: x["sort"])
 
-    dades_per_guardar = []
-    nou_doc = fitz.open() # New PDF document for reordered pages
+    # 1. Build new PDF
+    os.makedirs(os.path.dirname(ruta_out), exist_ok=True) # Ensure output directory exists
+    ruta_tmp = ruta_out + ".part"
+    ordre = [item["idx"] for item in pages_info]
+    if MODE_STREAMING:
+        doc.close()
+        escriure_pdf_per_finestres(ruta_in, ordre, ruta_tmp)
+    else:
+        escriure_pdf_reordenat(doc, ordre, ruta_tmp)
+        doc.close()
+    etapes["escriptura_pdf"], inici = time.perf_counter() - inici, time.perf_counter()
 
+    # 2. Save data for future use (the JSON map)
+    dades_per_guardar = []
     for nou_index, item in enumerate(pages_info):
-        # 1. Build new PDF
-        original_page_index = item["idx"]
-        pix = doc[original_page_index].get_pixmap(dpi=DPI_SORTIDA)
-        nova = nou_doc.new_page(width=pix.width, height=pix.height)
-        nova.insert_image(nova.rect, stream=pix.tobytes("jpg", jpg_quality=QUALITAT_JPG))
-
-        # 2. Save data for future use (the JSON map)
         dades_per_guardar.append({
             "nova_pagina_pdf": nou_index, # New page index (0, 1, 2, ...) in the reordered PDF
             "alumne_id": item["id"],
             "alumne_nom": item["nom"],
             "pagina_examen": item["pag_num"]
         })
-
-    # Save reordered PDF
-    os.makedirs(os.path.dirname(ruta_out), exist_ok=True) # Ensure output directory exists
-    nou_doc.save(ruta_out)
-    doc.close()
-    nou_doc.close()
+        # Roster mismatches (see resoldre_ids_desconeguts): the ID the QR carried, or the roster ID it may stand for
+        for clau in ("id_llegit", "id_suggerit"):
+            if clau in item: dades_per_guardar[-1][clau] = item[clau]
 
     # --- NEW PHASE: SAVE THE JSON MAP FILE ---
     ruta_json = ruta_out.replace(".pdf", ".json")
-    with open(ruta_json, "w", encoding="utf-8") as f:
+    with open(ruta_json + ".part", "w", encoding="utf-8") as f:
         json.dump(dades_per_guardar, f, indent=4, ensure_ascii=False)
+    os.replace(ruta_json + ".part", ruta_json)
     print(f"💾 Data map saved to: {os.path.basename(ruta_json)}")
+    # Before the PDF rename: a crash in between reprocesses the file, which replaces its rows
+    if FITXER_INDEX_PAGINES: qr_index.guardar_lot(FITXER_INDEX_PAGINES, ruta_out, pages_info)
+    etapes["mapa"] = time.perf_counter() - inici
+
+    if METRIQUES:
+        resum["metriques"] = qr_metrics.metriques_fitxer(nom_base, pages_info, etapes)
+        ruta_metriques = ruta_out.replace(".pdf", ".metrics.json")
+        qr_metrics.guardar_json(ruta_metriques, resum["metriques"])
+        print(f"📏 Metrics saved to: {os.path.basename(ruta_metriques)}")
+
+    # The PDF is renamed last: its existence is what tells main() the file is already processed
+    os.replace(ruta_tmp, ruta_out)
 
     # PHASE 4: Audit
     auditoria_final(pages_info)
     print("✨ Done!")
-    return True
+    resum.update({"ok": True, "pagines": len(pages_info), "fallades": sum(1 for p in pages_info if p["id"] is None and p.get("especial") != "blanca")})
+    return resum
+
+def processar_fitxer(ruta_in, ruta_out, workers=None):
+    """processar_un_pdf for main(): an unexpected error fails this file only, so the run goes on and is summarised."""
+    try:
+        return processar_un_pdf(ruta_in, ruta_out, DICCIONARI_ALUMNES, workers=workers)
+    except Exception as e:
+        print(f"❌ ERROR: Unexpected failure processing '{ruta_in}': {e}", file=sys.stderr)
+        return {"fitxer": os.path.basename(ruta_in), "ok": False, "pagines": 0, "fallades": 0}
+
+def processar_fitxer_worker(ruta_in, ruta_out):
+    """Scheduler task: processes one whole PDF inside a worker (pages decoded sequentially)."""
+    abans = copiar_estadistiques_cascada()
+    resum = processar_fitxer(ruta_in, ruta_out, workers=1)
+    resum["estadistiques_cascada"] = diferencia_estadistiques_cascada(abans)
+    return resum
+
+def comptar_pagines(ruta_pdf):
+    try:
+        with fitz.open(ruta_pdf) as doc:
+            return doc.page_count
+    except Exception:
+        return 0 # Unreadable files are still scheduled so that the failure shows up in the summary
+
+def planificar_fitxers(arxius):
+    """Reads every PDF's page count up front and returns (pages, name) pairs, largest first."""
+    feina = [(comptar_pagines(os.path.join(CARPETA_ENTRADA, f)), f) for f in arxius]
+    feina.sort(key=lambda x: (-x[0], x[1]))
+    return feina
+
+def imprimir_resum_execucio(resultats, temps_total):
+    pagines = sum(r["pagines"] for r in resultats)
+    print("📊 --- RUN SUMMARY ---")
+    for r in sorted(resultats, key=lambda x: x["fitxer"]):
+        if not r["ok"]:
+            print(f"❌ {r['fitxer']}: FAILED")
+        else:
+            print(f"{'⚠️' if r['fallades'] else '✅'} {r['fitxer']}: {r['pagines']} pages, {r['fallades']} without QR")
+    velocitat = pagines / temps_total if temps_total > 0 else 0.0
+    print(f"⏱️ {len(resultats)} files, {pagines} pages in {temps_total:.1f}s ({velocitat:.2f} pages/sec)")
+    print("--------------------")
+
+def auditoria_global():
+    """Missing pages over every indexed batch. A student whose sheets were scanned in two batches
+    is complete here, even though the audit of each batch reports a gap."""
+    try:
+        faltes = qr_index.pagines_que_falten(FITXER_INDEX_PAGINES)
+    except Exception as e:
+        print(f"⚠️ Could not read the page index ({e}).", file=sys.stderr)
+        return
+    print("🔍 --- AUDIT (all batches) ---")
+    for id_alumne, pagines in sorted(faltes.items()):
+        print(f"⚠️ {id_alumne}: Missing pages {pagines}")
+    if not faltes: print("✅ No student is missing pages across the indexed batches.")
+    print("--------------------")
 
 def main():
     # Load student data from Excel files (or a local placeholder)
     carregar_base_dades_alumnes()
+    carregar_estadistiques_cascada()
 
     os.makedirs(CARPETA_ENTRADA, exist_ok=True)
     os.makedirs(CARPETA_SORTIDA, exist_ok=True)
@@ -358,16 +1327,41 @@ def main():
         print(f"⚠️ No PDF files found in '{CARPETA_ENTRADA}'. Please upload scanned exams.")
         return
 
+    # Skip if output file already exists (outputs are renamed into place only when complete)
+    pendents = []
     for f in arxius:
-        in_p = os.path.join(CARPETA_ENTRADA, f)
-        out_p = os.path.join(CARPETA_SORTIDA, f)
-        
-        # Skip if output file already exists
-        if os.path.exists(out_p):
+        if os.path.exists(os.path.join(CARPETA_SORTIDA, f)):
             print(f"⏭️ Skipping '{f}' (already processed).")
-            continue
-        
-        processar_un_pdf(in_p, out_p, DICCIONARI_ALUMNES) # Pass DICCIONARI_ALUMNES to the function
+        else:
+            pendents.append(f)
+    if not pendents:
+        return
+
+    inici = time.time()
+    feina = planificar_fitxers(pendents)
+    workers = min(WORKERS_FITXERS or os.cpu_count() or 1, len(feina))
+    resultats = []
+
+    if workers <= 1:
+        for _, f in feina:
+            resultats.append(processar_fitxer(os.path.join(CARPETA_ENTRADA, f), os.path.join(CARPETA_SORTIDA, f)))
+    else:
+        # Largest files are submitted first so that the small ones fill the gaps at the end of the run.
+        # The student dictionary is sent once per worker through the initializer.
+        print(f"⚙️ Scheduling {len(feina)} PDFs ({sum(n for n, _ in feina)} pages) on {workers} workers...")
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                 initializer=inicialitzar_worker, initargs=(DICCIONARI_ALUMNES, copiar_estadistiques_cascada(), INDEX_ALUMNES)) as executor:
+            futurs = [executor.submit(processar_fitxer_worker, os.path.join(CARPETA_ENTRADA, f), os.path.join(CARPETA_SORTIDA, f)) for _, f in feina]
+            resultats = [futur.result() for futur in futurs]
+        for r in resultats:
+            fusionar_estadistiques_cascada(r.pop("estadistiques_cascada", {}))
+
+    imprimir_resum_execucio(resultats, time.time() - inici)
+    if FITXER_INDEX_PAGINES: auditoria_global()
+    guardar_estadistiques_cascada()
+    if METRIQUES and FITXER_PROMETHEUS:
+        qr_metrics.guardar_prometheus(FITXER_PROMETHEUS, [r["metriques"] for r in resultats if "metriques" in r])
 
 if __name__ == "__main__":
     main()